@@ -30,15 +30,32 @@ import tempfile
 import traceback
 import urllib
 import urllib2
+import urlparse
+import socket
 import re
 import sys
 import datetime
 import optparse
 import hashlib
+import zlib
 import ast
+import mmap
+import marshal
+import struct
+import bisect
+import math
 import fcntl
+import select
+import sqlite3
+import threading
 
 import base64
+import collections
+import json
+from array import array
+import cStringIO
+import xml.etree.cElementTree as ElementTree
+import contextlib
 from fractions import Fraction
 
 C_CLEAR			= "\033[0m"
@@ -94,10 +111,27 @@ Dies geschieht in mehreren Phasen, die weiter unten beschrieben werden.
     -s, --no-suggestions
         Dateinamenvorschläge von Cutlists werden nicht berücksichtigt.
 
+    -j $d, --jobs $d
+        Anzahl der Dateien, die gleichzeitig geschnitten werden.
+        [default: 1, bzw. cutworkers= aus der Konfigurationsdatei]
+
+    -p, --pipeline
+        Dateien werden bereits im Hintergrund geschnitten, während für die
+        nächsten Dateien noch Cutlists ausgewählt werden.
+
     --config $name
         Gibt den Namen der zu verwendenden Konfigurationsdatei an.
         [default: ~/.multicut_evolution.conf]
 
+    --cache-gc
+        Entfernt abgelaufene Einträge aus dem Cache und beendet das Programm.
+
+    --cache-migrate
+        Schreibt alle Cache-Einträge im eingestellten Format neu (siehe
+        cachecompression= und cachebackend=) und beendet das Programm. Mit
+        cachebackend=sqlite werden dabei die Einzeldateien in die Datenbank
+        übernommen und gelöscht.
+
     --verbosity $d
         Debuginformationen werden entsprechend ausgegeben.
         [default: 0, maximal 5]
@@ -124,7 +158,11 @@ Dies geschieht in mehreren Phasen, die weiter unten beschrieben werden.
         Eingaben wie '1,2-5' zulässig.
 
     Phase 2 - Schneiden
-        In dieser Phase ist keine Benutzerinteraktion notwendig.
+        In dieser Phase ist keine Benutzerinteraktion notwendig. Mit '-j $d'
+        werden bis zu $d Dateien gleichzeitig geschnitten. Mit '-p' beginnt
+        das Schneiden schon während Phase 1, sobald eine Cutlist gewählt
+        wurde. Wird eine Cutlist umgewählt, wird der zugehörige
+        Schneidevorgang verworfen und neu eingereiht.
 
     Phase 3 - Überprüfen der Schnitte
         Nun können die Filme ausgewählt werden, die überprüft werden sollen. Dabei
@@ -206,6 +244,80 @@ prog_config_help = \
         cachedir=
             Pfad zu Cache [default: ~/.cache/mutlicut/]
             Ein leerer Pfad bedeutet kein Caching von herunterladen Cutlists.
+            Im Unterverzeichnis aviindex werden die Indizes der AVI-Dateien
+            für die Direktkopie (smartcopy=) abgelegt.
+        cachebackend=
+            Speicherformat des Caches: 'files' (eine Datei pro Eintrag) oder
+            'sqlite' (eine indizierte Datenbank cache.sqlite im Cache-Pfad,
+            schneller bei sehr vielen Einträgen). [default: files]
+        cachecompression=
+            Neue Cache-Einträge werden komprimiert gespeichert. Unkomprimierte
+            Einträge bleiben lesbar, --cache-migrate wandelt sie um. [default: true]
+        cachegcinterval=
+            Abgelaufene Cache-Einträge werden höchstens alle so viele Stunden
+            im Hintergrund entfernt. 0 schaltet das ab, dann räumt nur
+            --cache-gc auf. [default: 24]
+        memorycacheentries=
+            Höchstzahl der Einträge, die jeder Cache im Arbeitsspeicher hält.
+            Die am längsten nicht benutzten werden zuerst verworfen.
+            0 bedeutet unbegrenzt. [default: 200]
+        memorycachemb=
+            Höchstgröße in MB, die jeder Cache im Arbeitsspeicher belegt.
+            0 bedeutet unbegrenzt. [default: 16]
+        cutworkers=
+            Anzahl der Dateien, die gleichzeitig geschnitten werden. Kann mit
+            der Option -j überschrieben werden. [default: 1]
+        pipeline=
+            Schneidet bereits während der Cutlistauswahl im Hintergrund
+            (siehe Option -p). [default: false]
+        prefetchworkers=
+            Anzahl der gleichzeitigen Verbindungen, mit denen vorab die
+            Cutlistübersichten und Kommentare für alle Dateien geladen
+            werden. 0 schaltet das Vorabladen ab. [default: 4]
+        prefetchcutlists=
+            Anzahl der am besten bewerteten Cutlists je Datei, die schon im
+            Hintergrund heruntergeladen werden, damit Auswahl und 'test'
+            sofort beginnen. [default: 3]
+        httptimeout=
+            Zeitlimit in Sekunden für Anfragen an cutlist.at und OTR. [default: 30]
+        httpretries=
+            Anzahl der Wiederholungen einer fehlgeschlagenen Anfrage. [default: 3]
+        smartcopy=
+            Beginnen alle Schnitte einer Cutlist auf einem Keyframe und enden
+            sie direkt vor einem Keyframe, wird die AVI-Datei ohne
+            Avidemux/VirtualDub geschnitten, indem die Daten unverändert
+            kopiert werden. [default: false]
+        renderworkers=
+            Anzahl der VirtualDub-Prozesse, die die Segmente einer HQ/HD-Datei
+            gleichzeitig rendern. Lange Segmente werden dafür an Keyframes
+            geteilt, am Ende werden die Teile verlustfrei aneinandergehängt.
+            [default: 1]
+        keyframeinfo=
+            Lädt alle Cutlists einer Aufnahme und zeigt in der Übersicht für
+            jeden Schnitt den Abstand zum nächsten Keyframe sowie die Anzahl
+            der Frames, die neu kodiert werden müssen. [default: false]
+        keyframepenalty=
+            Zieht je neu zu kodierender Sekunde so viele Punkte von der
+            Metabewertung ab, nach der die Cutlists sortiert werden (nur mit
+            keyframeinfo=). [default: 0]
+        validatecutlists=
+            Vergleicht Dateigröße, Framerate und das Ende des letzten Schnitts
+            der gewählten Cutlist mit der Aufnahme und fragt nach, wenn sie
+            nicht passt. Bereits geladene Cutlists (siehe keyframeinfo=)
+            werden in der Übersicht markiert. [default: true]
+        processtimeout=
+            Maximale Laufzeit in Sekunden eines Schneideprogramms (Avidemux,
+            VirtualDub), danach wird es beendet. 0 schaltet das
+            Zeitlimit ab. [default: 0]
+        processinactivity=
+            Ein Schneideprogramm, das so viele Sekunden lang keine Ausgabe
+            macht, gilt als hängengeblieben und wird beendet. 0 schaltet die
+            Überwachung ab. [default: 0]
+        progressinterval=
+            Gibt während des Schneidens alle so viele Sekunden den Fortschritt
+            jeder Datei und aller Dateien aus (geschriebene MB, MB/s, Frames/s
+            und verbleibende Zeit, geschätzt aus der Größe der Ausgabedateien).
+            0 schaltet die Ausgabe ab. [default: 10]
 
             
     Beschreibung der Sprache für die Namensgebung von Dateien:
@@ -313,7 +425,6 @@ h264_settings = {
 	'x264vfw_mp4_string': '--force-cfr --profile baseline --preset medium --trellis 0',
 	}
 
-
 avidemux_cmds = ["avidemux2_cli", "avidemux_cli",
 					"avidemux2", "avidemux",
 					"avidemux2_qt4", "avidemux_qt4",
@@ -323,6 +434,7 @@ avidemux_cmds = ["avidemux2_cli", "avidemux_cli",
 search_request_expire_period = datetime.timedelta(hours=2)
 cutlist_expire_period = datetime.timedelta(days=12)
 comments_expire_period = datetime.timedelta(hours=2)
+probe_expire_period = datetime.timedelta(days=30)
 
 ###
 # Helper functions
@@ -332,14 +444,53 @@ def Debug(level, text):
 		print "Debug (%d): %s" % (level,text)
 
 
-def Run(cmd, args):
+def Run(cmd, args, runner=None, **kwargs):
+	"""
+	runs cmd and returns (stdout, stderr), raises a ProcessError if it was killed;
+	the keyword arguments are passed to ProcessRunner.Start
+	"""
 	Debug(2, "running %s with args %s" % (cmd,args))
-	sub = subprocess.Popen(args = [cmd] + args, stdout = subprocess.PIPE, stderr = subprocess.PIPE)	
-	out, err = sub.communicate()
+	runner = runner or ProcessRunner()
+	process = runner.Start([cmd] + args, **kwargs)
+	runner.Wait([process])
+	out, err = process.Output()
 	Debug(4, "errout: %s" % err)
 	Debug(5, "out: %s" % out)
+	process.Check()
 	return out, err
 
+def ParallelMap(function, items, workers):
+	"""
+	calls function for every item with at most workers threads,
+	returns the results in the order of items (None if function raised)
+	"""
+	items = list(items)
+	results = [None] * len(items)
+	todo = range(len(items))
+	lock = threading.Lock()
+	
+	def worker():
+		while True:
+			with lock:
+				if not todo:
+					return
+				i = todo.pop(0)
+			try:
+				results[i] = function(items[i])
+			except StandardError:
+				Debug(1, traceback.format_exc())
+	
+	threads = []
+	for _ in range(max(1, min(workers, len(items)))):
+		thread = threading.Thread(target=worker)
+		thread.daemon = True
+		thread.start()
+		threads.append(thread)
+	for thread in threads:
+		while thread.is_alive():
+			thread.join(0.5) # a timeout keeps KeyboardInterrupt working
+	return results
+
 def ParseIIRange(iis):
 	return sum([ParseII(ii) for ii in iis.split(',')],[])
 
@@ -364,19 +515,238 @@ def ParseII(ii):
 	a,step,b = int(a), int(step), int(b)
 	return range(a,b+1,step)
 
+###
+# process runner
+###
+class ProcessError(OSError):
+	""" an external program was killed: reason is 'timeout', 'inactivity' or 'cancelled' """
+	def __init__(self, cmd, reason):
+		OSError.__init__(self, "%s wurde abgebrochen (%s)" % (cmd, reason))
+		self.cmd = cmd
+		self.reason = reason
+
+process_line_re = re.compile("[\r\n]")
+
+class Process:
+	"""
+	a child process of a ProcessRunner; its output is split into lines (at \\n and \\r,
+	progress is usually terminated by \\r only) and passed to the callbacks
+	"""
+	def __init__(self, args, on_stdout=None, on_stderr=None, on_tick=None, timeout=None, inactivity=None, collect=True, **popenargs):
+		self.sub = subprocess.Popen(args, stdout = subprocess.PIPE, stderr = subprocess.PIPE, close_fds = True, **popenargs)
+		self.name = os.path.basename(args[0]) if not isinstance(args, basestring) else args
+		self.fds = stdout, stderr = self.sub.stdout.fileno(), self.sub.stderr.fileno()
+		self.callbacks = {stdout: on_stdout, stderr: on_stderr}
+		self.pending = {stdout: '', stderr: ''}
+		self.output = {stdout: [], stderr: []} if collect else None
+		self.open = set([stdout, stderr])
+		self.on_tick = on_tick
+		self.timeout = timeout
+		self.inactivity = inactivity
+		self.started = self.active = self.ticked = time.time()
+		self.returncode = None
+		self.killed = None
+	
+	def Read(self, fd):
+		try:
+			data = os.read(fd, 64 * 1024)
+		except OSError:
+			data = ''
+		self.Feed(fd, data)
+	
+	def Feed(self, fd, data):
+		if data:
+			self.active = time.time()
+			if self.output is not None:
+				self.output[fd].append(data)
+		else:
+			self.open.discard(fd)
+		callback = self.callbacks[fd]
+		if callback:
+			lines = process_line_re.split(self.pending[fd] + (data or '\n'))
+			self.pending[fd] = lines.pop()
+			for line in lines:
+				if line:
+					callback(line)
+	
+	def Update(self, now, tick):
+		if self.timeout and now - self.started > self.timeout:
+			self.Kill('timeout')
+		elif self.inactivity and now - self.active > self.inactivity:
+			self.Kill('inactivity')
+		if self.on_tick and now - self.ticked >= tick:
+			self.ticked = now
+			self.on_tick()
+		if self.sub.poll() is not None:
+			# drain the pipes, a forked child may still keep them open
+			for _ in xrange(64):
+				readable = select.select(list(self.open), [], [], 0)[0] if self.open else []
+				if not readable:
+					break
+				for fd in readable:
+					self.Read(fd)
+			for fd in list(self.open):
+				self.Feed(fd, '')
+			self.sub.stdout.close()
+			self.sub.stderr.close()
+			self.returncode = self.sub.returncode
+	
+	def Kill(self, reason):
+		if self.returncode is None and not self.killed:
+			Debug(2, "Process::Kill: %s (%s)" % (self.name, reason))
+			self.killed = reason
+			try:
+				self.sub.kill()
+			except OSError:
+				pass
+	
+	def Output(self):
+		""" collected (stdout, stderr) """
+		if self.output is None:
+			return "", ""
+		return ''.join(self.output[self.fds[0]]), ''.join(self.output[self.fds[1]])
+	
+	def Check(self):
+		if self.killed in ('timeout', 'inactivity', 'cancelled'):
+			raise ProcessError(self.name, self.killed)
+
+class ProcessRunner:
+	"""
+	runs external programs and streams their output line by line through one select loop,
+	hence several children can run at the same time; a child is killed after a wall-clock
+	timeout, after a period without output or when the runner is cancelled (from any thread)
+	"""
+	def __init__(self, tick=0.5):
+		self.tick = tick
+		self.lock = threading.Lock()
+		self.processes = []
+		self.cancelled = False
+	
+	def Start(self, args, **kwargs):
+		"""
+		starts args (list) and returns the Process, keyword arguments:
+		on_stdout/on_stderr: called with every line, on_tick: called about every tick seconds,
+		timeout/inactivity: seconds (0/None: unlimited), collect: keep the output for Output(),
+		further arguments are passed to subprocess.Popen
+		"""
+		with self.lock:
+			if self.cancelled:
+				raise ProcessError(os.path.basename(args[0]), 'cancelled')
+			process = Process(args, **kwargs)
+			self.processes.append(process)
+		return process
+	
+	def Wait(self, processes=None, first=False):
+		""" drives all children until processes (default: all) or the first of them have finished, returns the finished ones """
+		with self.lock:
+			processes = list(self.processes if processes is None else processes)
+		try:
+			while True:
+				finished = [process for process in processes if process.returncode is not None]
+				if len(finished) == len(processes) or (first and finished):
+					return finished
+				self.Step()
+		except KeyboardInterrupt:
+			self.Cancel()
+			raise
+	
+	def Step(self):
+		with self.lock:
+			running = list(self.processes)
+		fds = dict((fd, process) for process in running for fd in process.open)
+		if fds:
+			for fd in select.select(list(fds), [], [], self.tick)[0]:
+				fds[fd].Read(fd)
+		else:
+			time.sleep(self.tick)
+		now = time.time()
+		for process in running:
+			process.Update(now, self.tick)
+			if process.returncode is not None:
+				with self.lock:
+					self.processes.remove(process)
+	
+	def Cancel(self):
+		""" kills all children, later Start calls fail """
+		with self.lock:
+			self.cancelled = True
+			processes = list(self.processes)
+		for process in processes:
+			process.Kill('cancelled')
+
 ###
 # Helper class
 ###
+class MemoryCache:
+	"""
+	dictionary bounded by number of entries and bytes, evicts the least recently used
+	entries first and counts hits, misses and evictions
+	"""
+	def __init__(self, maxentries=None, maxbytes=None):
+		self.maxentries = maxentries
+		self.maxbytes = maxbytes
+		
+		self.entries = collections.OrderedDict()
+		self.size = 0
+		
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+	
+	def __len__(self):
+		return len(self.entries)
+	
+	def __contains__(self, key):
+		return key in self.entries
+	
+	def get(self, key, default=None):
+		try:
+			value, size = self.entries.pop(key)
+		except KeyError:
+			self.misses += 1
+			return default
+		self.entries[key] = (value, size) # most recently used is last
+		self.hits += 1
+		return value
+	
+	def __setitem__(self, key, value):
+		if key in self.entries:
+			self.size -= self.entries.pop(key)[1]
+		size = sys.getsizeof(value)
+		if self.maxbytes and size > self.maxbytes:
+			return # would evict everything else
+		self.entries[key] = (value, size)
+		self.size += size
+		
+		while (self.maxentries and len(self.entries) > self.maxentries) or (self.maxbytes and self.size > self.maxbytes):
+			_, (_, evictedsize) = self.entries.popitem(last=False)
+			self.size -= evictedsize
+			self.evictions += 1
+	
+	def statistics(self):
+		return "%d entries, %d bytes, %d hits, %d misses, %d evictions" % \
+				(len(self.entries), self.size, self.hits, self.misses, self.evictions)
+
+# mkstemp creates files readable by the owner only, cache files get the permissions of the umask
+file_umask = os.umask(0)
+os.umask(file_umask)
+# temporary files of atomic writes older than this are left over from a crash
+stale_tempfile_age = 3600
+
 class FileCache:
 	"""
 	caches calls to getter
 	"""
-	def __init__(self, name, directory, getter, expireperiod=None, debug=lambda x:None):
+	# compressed entries start with this, entries without it are plain utf8
+	compressedmarker = "\x00MCZ\x01"
+	
+	def __init__(self, name, directory, getter, expireperiod=None, debug=lambda x:None, memoryentries=None, memorybytes=None, compress=False):
 		self.name = name
 		self.directory = directory
 		self.getter = getter
 		self.expireperiod = expireperiod
 		self.debug = debug
+		self.compress = compress
 		
 		
 		if self.directory:
@@ -388,88 +758,259 @@ class FileCache:
 			self.fileCacheEnabled = False
 		
 		# cache trackers
-		self.memoryCache = {}
+		self.memoryCache = MemoryCache(memoryentries, memorybytes)
 		self.fileCache = {}
+		self.indexOffset = 0
+		self.indexInode = None
 		
-		# load file cache index
-		self.loadFileCache()
+		# the cache is shared by the prefetch threads
+		self.lock = threading.RLock()
+		self.inflight = {}
+		
+		# the file cache index is loaded on first use
+		self.loaded = False
+	
+	def ensureLoaded(self):
+		with self.lock:
+			if not self.loaded:
+				self.loadFileCache()
+				self.loaded = True
 		
 	#
 	# file system cache
 	#
 	def getIndexFileName(self):
 		return os.path.join(self.directory, "%s.index" % self.name)
+	def getMaintenanceFileName(self):
+		return os.path.join(self.directory, "%s.gc" % self.name)
+	def getLockFileName(self):
+		return os.path.join(self.directory, "%s.lock" % self.name)
 	def getFileName(self, uuid):
 		return os.path.join(self.directory, "%s.%s" % (uuid,self.name))
 	def convertTime2String(self, dt):
 		return str(tuple(list(dt.timetuple())[:6]))
 	def convertString2Time(self, dt_raw):
-		dt = ast.literal_eval(dt_raw)
+		# cheaper than ast.literal_eval for the '(y, m, d, H, M, S)' format written above
+		dt = [int(v) for v in dt_raw.strip().strip('()').split(',')]
 		return datetime.datetime(*dt[:6])
+	
+	def encodeContent(self, content):
+		data = content.encode('utf8') if isinstance(content, unicode) else content
+		if self.compress:
+			data = self.compressedmarker + zlib.compress(data, 6)
+		return data
+	def decodeContent(self, data):
+		if data.startswith(self.compressedmarker):
+			data = zlib.decompress(data[len(self.compressedmarker):])
+		return unicode(data, 'utf8')
+	
+	def isExpired(self, dt_raw, now):
+		return self.expireperiod and self.convertString2Time(dt_raw) + self.expireperiod < now
+	
+	#
+	# several processes may share the cache directory
+	#
+	@contextlib.contextmanager
+	def fileLock(self, exclusive=False):
+		""" advisory lock on <name>.lock, only to be taken while holding self.lock """
+		lockfile = open(self.getLockFileName(), 'a')
+		try:
+			fcntl.flock(lockfile.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+			yield
+		finally:
+			lockfile.close() # releases the lock
+	
+	def atomicWrite(self, fname, data):
+		""" readers see either the old or the new file, never a partial one """
+		fd, tmpname = tempfile.mkstemp(dir=self.directory, prefix=".%s." % self.name)
+		try:
+			os.fchmod(fd, 0666 & ~file_umask)
+			with os.fdopen(fd, 'wb') as f:
+				f.write(data)
+			os.rename(tmpname, fname)
+		except:
+			try:	os.remove(tmpname)
+			except:	pass
+			raise
 		
+	def readIndex(self, offset=0):
+		""" returns ({uuid: dt_raw}, end offset, inode) of the index from offset on, later entries win """
+		entries = {}
+		try:
+			f = open(self.getIndexFileName(), 'rb')
+		except IOError:
+			return entries, 0, None
+		with f:
+			inode = os.fstat(f.fileno()).st_ino
+			f.seek(offset)
+			index = f.read()
+		
+		for line in index.split('\n'):
+			if not line: continue
+			uuid, dt_raw = line.split('\t')
+			entries[uuid] = dt_raw
+		return entries, offset + len(index), inode
 
 	def loadFileCache(self):
+		""" reads the index only, expired entries are ignored but removed by maintain """
 		if not self.fileCacheEnabled:
 			return
 
+		with self.fileLock():
+			entries, self.indexOffset, self.indexInode = self.readIndex()
 		now = datetime.datetime.now()
 		self.fileCache = {}
-		indexfile = self.getIndexFileName()
+		for uuid, dt_raw in entries.items():
+			if not self.isExpired(dt_raw, now):
+				self.fileCache[uuid] = dt_raw
+	
+	def refreshFileCache(self):
+		""" picks up entries other processes appended to the index since it was loaded """
+		if not self.fileCacheEnabled:
+			return
 		
-		try:
-			index = codecs.open(indexfile, 'r', 'utf8').read()
-		except:
+		with self.fileLock():
+			try:
+				stat = os.stat(self.getIndexFileName())
+			except OSError:
+				return
+			if stat.st_ino != self.indexInode or stat.st_size < self.indexOffset:
+				entries = None # index was compacted, reload all
+			else:
+				entries, self.indexOffset, _ = self.readIndex(self.indexOffset)
+		if entries is None:
+			self.loadFileCache()
 			return
+		now = datetime.datetime.now()
+		for uuid, dt_raw in entries.items():
+			if not self.isExpired(dt_raw, now):
+				self.fileCache[uuid] = dt_raw
+	
+	#
+	# maintenance
+	#
+	def maintain(self, interval=None):
+		"""
+		removes expired files and compacts the index,
+		skipped if the last maintenance was less than interval (timedelta) ago
+		"""
+		if not self.fileCacheEnabled:
+			return False
 		
-		for line in index.split('\n'):
-			if not line: continue
-			uuid, dt_raw = line.split('\t')
-			
+		stamp = self.getMaintenanceFileName()
+		if interval and os.path.exists(stamp):
+			last = datetime.datetime.fromtimestamp(os.path.getmtime(stamp))
+			if last + interval > datetime.datetime.now():
+				self.debug("FileCache('%s')::maintain: skipped, last run %s" % (self.name, last))
+				return False
+		
+		self.maintainFileCache()
+		open(stamp, 'w').close()
+		return True
+	
+	def maintainFileCache(self):
+		"""
+		the locks are only held to read and compact the index, so that get() is not
+		blocked by the file system; the index is not loaded into this cache for it
+		"""
+		# entries whose file is gone, checked without any lock
+		with self.lock:
+			with self.fileLock():
+				entries = self.readIndex()[0]
+		missing = set(item for item in entries.iteritems() if not os.path.isfile(self.getFileName(item[0])))
+		
+		now = datetime.datetime.now()
+		started = time.time()
+		expired = []
+		with self.lock:
+			with self.fileLock(exclusive=True):
+				index = []
+				for uuid, dt_raw in self.readIndex()[0].items():
+					if self.isExpired(dt_raw, now):
+						expired.append(uuid)
+						self.fileCache.pop(uuid, None)
+					elif (uuid, dt_raw) in missing:
+						self.fileCache.pop(uuid, None)
+					else:
+						index.append( "%s\t%s" % (uuid, dt_raw) )
+				self.atomicWrite(self.getIndexFileName(), '\n'.join(index))
+				stat = os.stat(self.getIndexFileName())
+				if self.loaded:
+					self.indexOffset, self.indexInode = stat.st_size, stat.st_ino
+		
+		for uuid in expired:
 			fname = self.getFileName(uuid)
-			dt = self.convertString2Time(dt_raw)
-			
-			if self.expireperiod and dt + self.expireperiod < now:
-				self.debug("FileCache('%s')::loadFileCache: removed expired file %s"%(self.name,fname))
-				self.debug("FileCache('%s')::loadFileCache: condition: %s + %s < %s" % (self.name, dt, self.expireperiod, now))
-				try: 	os.remove(fname)
-				except:	pass
-			else:
-				if os.path.isfile(fname):
-					self.fileCache[uuid] = dt_raw
+			try:
+				# a file written since the index was compacted belongs to a new entry
+				if os.path.getmtime(fname) < started:
+					os.remove(fname)
+					self.debug("FileCache('%s')::maintain: removed expired file %s"%(self.name,fname))
+			except OSError:
+				pass
 		
-		index = []
-		for uuid, dt_raw in self.fileCache.items():
-			index.append( "%s\t%s" % (uuid, dt_raw) )
-		codecs.open(indexfile, 'w', 'utf8').write('\n'.join(index))
+		# temporary files of atomicWrite a crashed process left behind
+		prefix = ".%s." % self.name
+		for fname in os.listdir(self.directory):
+			fname = os.path.join(self.directory, fname)
+			try:
+				if os.path.basename(fname).startswith(prefix) and os.path.getmtime(fname) < started - stale_tempfile_age:
+					os.remove(fname)
+					self.debug("FileCache('%s')::maintain: removed stale temporary file %s"%(self.name,fname))
+			except OSError:
+				pass
 	
 	
-	def appendFileCache(self, uuid, content):
+	def appendFileCache(self, uuid, content, x=None):
 		if not self.fileCacheEnabled:
 			return
 
-		fname = self.getFileName(uuid)
-		codecs.open(fname, 'w', 'utf8').write(content)
-		
-		indexfile = self.getIndexFileName()
 		now = datetime.datetime.now()
 		now_raw = self.convertTime2String(now)
 		appendindex = "\n%s\t%s" % (uuid, now_raw)
-		codecs.open(indexfile, 'a', 'utf8').write(appendindex)
+		with self.fileLock(exclusive=True):
+			self.writeFileContent(uuid, content)
+			open(self.getIndexFileName(), 'ab').write(appendindex)
+	
+	def hasFileContent(self, uuid):
+		return self.fileCacheEnabled and uuid in self.fileCache
 	
 	def readFileContent(self, uuid):
 		fname = self.getFileName(uuid)
-		return codecs.open(fname, 'r', 'utf8').read()
+		return self.decodeContent(open(fname, 'rb').read())
+	
+	def writeFileContent(self, uuid, content):
+		self.atomicWrite(self.getFileName(uuid), self.encodeContent(content))
+	
+	def migrate(self):
+		""" rewrites all entries in the current format, returns the number of rewritten entries """
+		if not self.fileCacheEnabled:
+			return 0
+		
+		count = 0
+		with self.lock:
+			self.ensureLoaded()
+			with self.fileLock(exclusive=True):
+				for uuid in self.fileCache.keys():
+					try:
+						data = open(self.getFileName(uuid), 'rb').read()
+					except IOError:
+						continue
+					if self.compress != data.startswith(self.compressedmarker):
+						self.writeFileContent(uuid, self.decodeContent(data))
+						count += 1
+		return count
 		
 	def updateContent(self, x, content):
 		uuid = hashlib.sha1(x).hexdigest()
 		
-		if uuid in self.fileCache:
-			fname = self.getFileName(uuid)
-			codecs.open(fname, 'w', 'utf8').write(content)
-		else:
-			self.appendFileCache(uuid, content)
-		
-		self.memoryCache[uuid] = content
+		with self.lock:
+			self.ensureLoaded()
+			if self.hasFileContent(uuid):
+				self.writeFileContent(uuid, content)
+			else:
+				self.appendFileCache(uuid, content, x)
+			
+			self.memoryCache[uuid] = content
 	
 	#
 	# actual getter
@@ -477,35 +1018,540 @@ class FileCache:
 	def get(self, x):
 		uuid = hashlib.sha1(x).hexdigest()
 		
-		if uuid in self.memoryCache:
-			self.debug("FileCache('%s')::get('%s'): memory cache hit" % (self.name,x))
-			return self.memoryCache[uuid]
+		with self.lock:
+			self.ensureLoaded()
+			content = self.memoryCache.get(uuid)
+			if content is not None:
+				self.debug("FileCache('%s')::get('%s'): memory cache hit" % (self.name,x))
+				return content
+			
+			event = self.inflight.get(uuid)
+			if not event:
+				self.inflight[uuid] = threading.Event()
+		
+		if event:
+			# another thread is already fetching x, wait for it (and retry if it failed)
+			self.debug("FileCache('%s')::get('%s'): waiting for other thread" % (self.name,x))
+			event.wait()
+			return self.get(x)
 		
 		try:
-			if uuid in self.fileCache and self.fileCacheEnabled:
+			return self.fetch(x, uuid)
+		finally:
+			with self.lock:
+				self.inflight.pop(uuid).set()
+	
+	def fetch(self, x, uuid):
+		try:
+			if not self.hasFileContent(uuid):
+				# another process may have fetched it meanwhile
+				with self.lock:
+					self.refreshFileCache()
+			if self.hasFileContent(uuid):
 				self.debug("FileCache('%s')::get('%s'): file cache hit" % (self.name,x))
 				content = self.readFileContent(uuid)
-				self.memoryCache[uuid] = content
+				with self.lock:
+					self.memoryCache[uuid] = content
 				return content
 		except:
 			print "File associated with '%s' not found -- ignoring" % uuid
 		
 		self.debug("FileCache('%s')::get('%s'): total cache miss" % (self.name,x))
 		content = self.getter(x)
-		self.appendFileCache(uuid, content)
-		self.memoryCache[uuid] = content
+		with self.lock:
+			self.appendFileCache(uuid, content, x)
+			self.memoryCache[uuid] = content
 		return content
 
 
+class SQLiteFileCache(FileCache):
+	"""
+	FileCache backend storing all entries in one indexed sqlite database,
+	so that startup does not depend on the number of cached entries
+	"""
+	def loadFileCache(self):
+		if not self.fileCacheEnabled:
+			return
+		
+		with self.lock:
+			self.db = sqlite3.connect(os.path.join(self.directory, "cache.sqlite"), timeout=30, check_same_thread=False)
+			self.db.execute("CREATE TABLE IF NOT EXISTS entries ("
+								"name TEXT NOT NULL, uuid TEXT NOT NULL, key TEXT, "
+								"created REAL NOT NULL, expires REAL, content TEXT NOT NULL, "
+								"PRIMARY KEY (name, uuid))")
+			self.db.execute("CREATE INDEX IF NOT EXISTS entries_expires ON entries (name, expires)")
+			self.db.commit()
+	
+	def refreshFileCache(self):
+		pass # the database always is up to date
+	
+	def maintainFileCache(self):
+		with self.lock:
+			self.ensureLoaded() # only opens the database
+			cursor = self.db.execute("DELETE FROM entries WHERE name = ? AND expires < ?", (self.name, time.time()))
+			self.debug("SQLiteFileCache('%s')::maintain: removed %d expired entries" % (self.name, cursor.rowcount))
+			self.db.commit()
+	
+	def toUnicode(self, text):
+		return text.decode('utf8', 'replace') if isinstance(text, str) else text
+	
+	def storeContent(self, content):
+		return sqlite3.Binary(self.encodeContent(content)) if self.compress else self.toUnicode(content)
+	
+	def appendFileCache(self, uuid, content, x=None):
+		if not self.fileCacheEnabled:
+			return
+		
+		now = time.time()
+		expires = now + self.expireperiod.total_seconds() if self.expireperiod else None
+		with self.lock:
+			self.db.execute("INSERT OR REPLACE INTO entries (name, uuid, key, created, expires, content) VALUES (?, ?, ?, ?, ?, ?)",
+								(self.name, uuid, self.toUnicode(x), now, expires, self.storeContent(content)))
+			self.db.commit()
+	
+	def hasFileContent(self, uuid):
+		if not self.fileCacheEnabled:
+			return False
+		
+		with self.lock:
+			row = self.db.execute("SELECT 1 FROM entries WHERE name = ? AND uuid = ? AND (expires IS NULL OR expires >= ?)",
+								(self.name, uuid, time.time())).fetchone()
+		return row is not None
+	
+	def readFileContent(self, uuid):
+		with self.lock:
+			row = self.db.execute("SELECT content FROM entries WHERE name = ? AND uuid = ?", (self.name, uuid)).fetchone()
+		if row is None:
+			raise KeyError(uuid)
+		return row[0] if isinstance(row[0], unicode) else self.decodeContent(str(row[0]))
+	
+	def writeFileContent(self, uuid, content):
+		with self.lock:
+			self.db.execute("UPDATE entries SET content = ? WHERE name = ? AND uuid = ?", (self.storeContent(content), self.name, uuid))
+			self.db.commit()
+	
+	def migrate(self):
+		"""
+		moves the entries of the file backend into the database and rewrites
+		all entries in the current format, returns the number of rewritten entries
+		"""
+		if not self.fileCacheEnabled:
+			return 0
+		
+		count = 0
+		with self.lock:
+			self.ensureLoaded()
+			
+			files = FileCache(self.name, self.directory, None, self.expireperiod, self.debug)
+			files.ensureLoaded()
+			for uuid, dt_raw in files.fileCache.items():
+				try:
+					content = files.readFileContent(uuid)
+				except (IOError, ValueError):
+					continue
+				created = time.mktime(files.convertString2Time(dt_raw).timetuple())
+				expires = created + self.expireperiod.total_seconds() if self.expireperiod else None
+				self.db.execute("INSERT OR IGNORE INTO entries (name, uuid, key, created, expires, content) VALUES (?, ?, NULL, ?, ?, ?)",
+									(self.name, uuid, created, expires, self.storeContent(content)))
+				os.remove(files.getFileName(uuid))
+				count += 1
+			self.db.commit()
+			if os.path.exists(files.getIndexFileName()):
+				os.remove(files.getIndexFileName())
+			
+			compressed = 'blob' if self.compress else 'text'
+			for uuid, content in self.db.execute("SELECT uuid, content FROM entries WHERE name = ? AND typeof(content) != ?",
+										(self.name, compressed)).fetchall():
+				content = content if isinstance(content, unicode) else self.decodeContent(str(content))
+				self.db.execute("UPDATE entries SET content = ? WHERE name = ? AND uuid = ?", (self.storeContent(content), self.name, uuid))
+				count += 1
+			self.db.commit()
+			self.db.execute("VACUUM")
+		return count
+
+def CreateFileCache(name, cutoptions, getter, expireperiod=None, pinned=False):
+	"""
+	creates a cache with the backend chosen in cutoptions; entries of a pinned cache
+	cannot be fetched again, without cache directory they are never evicted
+	"""
+	cacheclass = SQLiteFileCache if cutoptions.cachebackend == 'sqlite' else FileCache
+	if pinned and not cutoptions.cachedir:
+		memoryentries, memorybytes = None, None
+	else:
+		memoryentries, memorybytes = cutoptions.memorycacheentries, cutoptions.memorycachebytes
+	return cacheclass(name, cutoptions.cachedir, getter, expireperiod, lambda x: Debug(2, x),
+						memoryentries, memorybytes, cutoptions.cachecompression)
+
+###
+# media probe
+###
+# common pixel aspect ratios, probed values are snapped to them
+known_sample_aspects = [Fraction(1,1), Fraction(4,3), Fraction(12,11), Fraction(10,11), Fraction(16,11), Fraction(40,33),
+						Fraction(32,27), Fraction(8,9), Fraction(64,45), Fraction(16,15)]
+
+def NormalizeSampleAspect(sar):
+	""" returns sar (Fraction) as 'num:denom', snapped to a common pixel aspect ratio if it is close """
+	if not sar or sar <= 0:
+		return None
+	nearest = min(known_sample_aspects, key = lambda known: abs(known - sar))
+	if abs(nearest - sar) <= sar / 100:
+		sar = nearest
+	else:
+		sar = sar.limit_denominator(1000)
+	return "%d:%d" % (sar.numerator, sar.denominator)
+
+def ParseRatio(text):
+	""" '16:9', '25/1' or '1.7778' as Fraction, None if not a positive ratio """
+	try:
+		for separator in ":/":
+			if separator in text:
+				num, denom = text.split(separator, 1)
+				ratio = Fraction(int(num), int(denom))
+				break
+		else:
+			ratio = Fraction(text)
+	except (ValueError, ZeroDivisionError, TypeError):
+		return None
+	return ratio if ratio > 0 else None
+
+# sample aspect ratios of the H.264 VUI aspect_ratio_idc 1..16
+h264_sample_aspects = [None, (1,1), (12,11), (10,11), (16,11), (40,33), (24,11), (20,11), (32,11),
+						(80,33), (18,11), (15,11), (64,33), (160,99), (4,3), (3,2), (2,1)]
+avi_audio_codecs = {0x1: 'pcm', 0x50: 'mp2', 0x55: 'mp3', 0xff: 'aac', 0x2000: 'ac3'}
+
+class BitReader:
+	"""
+	reads bits and Exp-Golomb codes from a string
+	"""
+	def __init__(self, data):
+		self.data = data
+		self.pos = 0
+	
+	def u(self, bits):
+		value = 0
+		for _ in xrange(bits):
+			byte = ord(self.data[self.pos >> 3]) # IndexError at the end of data
+			value = (value << 1) | ((byte >> (7 - (self.pos & 7))) & 1)
+			self.pos += 1
+		return value
+	
+	def ue(self):
+		zeros = 0
+		while not self.u(1):
+			zeros += 1
+		return (1 << zeros) - 1 + self.u(zeros)
+	
+	def se(self):
+		value = self.ue()
+		return (value + 1) // 2 if value & 1 else -(value // 2)
+
+def ParseH264SampleAspect(sps):
+	"""
+	returns the sample aspect ratio (Fraction) of the VUI of a sequence parameter set,
+	1:1 if it is not signalled (as decoders assume), None for reserved values
+	"""
+	# remove the emulation prevention bytes
+	sps = re.sub('\x00\x00\x03', '\x00\x00', sps)
+	r = BitReader(sps[1:]) # skip the nal header
+	profile = r.u(8)
+	r.u(16) # constraint flags, level
+	r.ue() # seq_parameter_set_id
+	if profile in (100, 110, 122, 244, 44, 83, 86, 118, 128, 138, 139, 134, 135):
+		chroma_format = r.ue()
+		if chroma_format == 3:
+			r.u(1) # separate_colour_plane_flag
+		r.ue(); r.ue() # bit depths
+		r.u(1) # qpprime_y_zero_transform_bypass_flag
+		if r.u(1): # seq_scaling_matrix_present_flag
+			for i in xrange(8 if chroma_format != 3 else 12):
+				if r.u(1):
+					last = next = 8
+					for j in xrange(16 if i < 6 else 64):
+						if next:
+							next = (last + r.se() + 256) % 256
+						last = next or last
+	r.ue() # log2_max_frame_num_minus4
+	poc_type = r.ue()
+	if poc_type == 0:
+		r.ue()
+	elif poc_type == 1:
+		r.u(1); r.se(); r.se()
+		for _ in xrange(r.ue()):
+			r.se()
+	r.ue(); r.u(1) # max_num_ref_frames, gaps_in_frame_num_value_allowed_flag
+	r.ue(); r.ue() # picture size in macroblocks
+	if not r.u(1): # frame_mbs_only_flag
+		r.u(1)
+	r.u(1) # direct_8x8_inference_flag
+	if r.u(1): # frame_cropping_flag
+		r.ue(); r.ue(); r.ue(); r.ue()
+	if not r.u(1) or not r.u(1): # vui_parameters_present_flag, aspect_ratio_info_present_flag
+		return Fraction(1, 1)
+	idc = r.u(8)
+	if idc == 0: # unspecified
+		return Fraction(1, 1)
+	elif idc == 255:
+		sar = (r.u(16), r.u(16))
+	elif idc < len(h264_sample_aspects):
+		sar = h264_sample_aspects[idc]
+	else:
+		return None
+	return Fraction(*sar) if sar and sar[0] and sar[1] else None
+
+def ReadAviHeaders(path, blocksize = 64 * 1024):
+	"""
+	reads avih, strh and strf of an avi file and the first H.264 sequence parameter set,
+	only the first kilobytes of the file and of the movi list are read
+	"""
+	with open(path, 'rb') as f:
+		data = f.read(blocksize)
+		if data[0:4] != 'RIFF' or data[8:12] != 'AVI ':
+			raise ValueError("keine AVI-Datei")
+		
+		headers = {'streams': [], 'sps': None}
+		pos = 12
+		while pos + 12 <= len(data):
+			fourcc, size = avi_chunk_header.unpack_from(data, pos)
+			if fourcc == 'LIST' and data[pos+8:pos+12] == 'hdrl':
+				if pos + 8 + size > len(data):
+					f.seek(0)
+					data = f.read(min(pos + 8 + size, 2**20))
+				ParseAviHeaderList(data, pos + 12, min(pos + 8 + size, len(data)), headers)
+			elif fourcc == 'LIST' and data[pos+8:pos+12] == 'movi':
+				f.seek(pos + 12)
+				movi = f.read(blocksize)
+				for match in re.finditer('\x00\x00\x01([\x00-\xff])', movi):
+					if ord(match.group(1)) & 0x1f == 7:
+						headers['sps'] = movi[match.start(1):]
+						break
+				break
+			pos += 8 + size + (size & 1)
+	if 'avih' not in headers:
+		raise ValueError("AVI-Datei ohne Header")
+	return headers
+
+def ParseAviHeaderList(data, start, end, headers):
+	pos = start
+	while pos + 8 <= end:
+		fourcc, size = avi_chunk_header.unpack_from(data, pos)
+		if fourcc == 'avih':
+			headers['avih'] = struct.unpack_from("<IIIIIIIIII", data, pos + 8)
+		elif fourcc == 'LIST' and data[pos+8:pos+12] == 'strl':
+			ParseAviHeaderList(data, pos + 12, pos + 8 + size, headers)
+		elif fourcc == 'strh':
+			headers['streams'].append({'type': data[pos+8:pos+12], 'handler': data[pos+12:pos+16],
+				'scale': struct.unpack_from("<I", data, pos + 28)[0], 'rate': struct.unpack_from("<I", data, pos + 32)[0],
+				'length': struct.unpack_from("<I", data, pos + 40)[0]})
+		elif fourcc == 'strf' and headers['streams']:
+			headers['streams'][-1]['strf'] = data[pos+8:pos+8+size]
+		pos += 8 + size + (size & 1)
+
+class MediaProbe:
+	"""
+	probes every recording once (native AVI/H.264 header parser, ffprobe and
+	mplayer -identify as fallbacks) and caches
+	display and sample aspect, fps, frame count, codecs and audio tracks keyed by
+	path, size and modification time
+	"""
+	def __init__(self, cutoptions):
+		self.cutoptions = cutoptions
+		self.probeCache = CreateFileCache("probe", cutoptions, self._Probe, probe_expire_period)
+		self.caches = [self.probeCache]
+	
+	def GetKey(self, path):
+		st = os.stat(path)
+		return "%s|%d|%d" % (os.path.abspath(path), st.st_size, int(st.st_mtime))
+	
+	def Get(self, path):
+		""" returns the media information of path as dict """
+		return json.loads(self.probeCache.get(self.GetKey(path)))
+	
+	def _Probe(self, key):
+		path = key.rsplit('|', 2)[0]
+		for probe in (self.ProbeAvi, self.ProbeFFprobe, self.ProbeMPlayer):
+			try:
+				info = probe(path)
+			except (EnvironmentError, ValueError, KeyError, IndexError, struct.error), e:
+				Debug(1, "MediaProbe::%s('%s') failed: %s" % (probe.__name__, path, e))
+				continue
+			if info:
+				return json.dumps(info)
+		raise ValueError("Datei '%s' konnte nicht untersucht werden" % path)
+	
+	def Info(self, width, height, sar, fps, frames, vcodec, audio, prober):
+		info = {'width': width, 'height': height, 'sar': NormalizeSampleAspect(sar), 'dar': None,
+				'fps': float(fps) if fps else None, 'frames': frames, 'vcodec': vcodec, 'audio': audio, 'prober': prober}
+		if width and height:
+			dar = Fraction(width, height) * (ParseRatio(info['sar'] or '1:1'))
+			info['dar'] = "%d:%d" % (dar.numerator, dar.denominator)
+		return info
+	
+	def ProbeAvi(self, path):
+		headers = ReadAviHeaders(path)
+		videos = [stream for stream in headers['streams'] if stream['type'] == 'vids']
+		if not videos or 'strf' not in videos[0]:
+			return None
+		video = videos[0]
+		width, height, compression = struct.unpack_from("<ii4x4s", video['strf'], 4)
+		vcodec = compression.strip('\x00 ').lower()
+		
+		sar = None
+		if vcodec in ('h264', 'x264', 'avc1'):
+			if not headers['sps']:
+				return None # without the SPS the sample aspect is unknown, let the other probes try
+			sar = ParseH264SampleAspect(headers['sps'])
+			if not sar:
+				return None # reserved aspect_ratio_idc, let the other probes try
+			vcodec = 'h264'
+		
+		audio = []
+		for stream in headers['streams']:
+			if stream['type'] == 'auds' and len(stream.get('strf', '')) >= 8:
+				tag, channels, rate = struct.unpack_from("<HHI", stream['strf'])
+				audio.append({'codec': avi_audio_codecs.get(tag, hex(tag)), 'channels': channels or None, 'rate': rate or None})
+		fps = Fraction(video['rate'], video['scale']) if video['scale'] else None
+		return self.Info(width, abs(height), sar, fps, video['length'], vcodec, audio, 'avi')
+	
+	def ProbeFFprobe(self, path):
+		out = Run("ffprobe", ["-v", "error", "-print_format", "json", "-show_streams", path], timeout = 60)[0]
+		streams = json.loads(out)['streams']
+		videos = [stream for stream in streams if stream.get('codec_type') == 'video']
+		if not videos:
+			return None
+		video = videos[0]
+		
+		audio = [{'codec': stream.get('codec_name'), 'channels': stream.get('channels'),
+					'rate': int(stream.get('sample_rate', 0)) or None}
+				for stream in streams if stream.get('codec_type') == 'audio']
+		frames = video.get('nb_frames')
+		# ffprobe reports a missing sample aspect as '0:1' or 'N/A', decoders assume square pixels
+		sar = ParseRatio(video.get('sample_aspect_ratio', '')) or Fraction(1, 1)
+		return self.Info(video.get('width'), video.get('height'), sar,
+							ParseRatio(video.get('r_frame_rate', '')) or ParseRatio(video.get('avg_frame_rate', '')),
+							int(frames) if frames and frames.isdigit() else None,
+							video.get('codec_name'), audio, 'ffprobe')
+	
+	def ProbeMPlayer(self, path):
+		# the ID_ lines are the same in every language
+		out = Run("mplayer", ["-identify", "-vo", "null", "-ao", "null", "-nosound", "-frames", "1", path], timeout = 60)[0]
+		values = {}
+		for line in out.splitlines():
+			if line.startswith("ID_") and '=' in line:
+				key, value = line.split('=', 1)
+				values[key] = value.strip() # later values (e.g. the aspect after decoding) win
+		if 'ID_VIDEO_WIDTH' not in values:
+			return None
+		
+		width, height = int(values['ID_VIDEO_WIDTH']), int(values['ID_VIDEO_HEIGHT'])
+		dar = ParseRatio(values.get('ID_VIDEO_ASPECT', ''))
+		sar = dar * height / width if dar else None
+		audio = [{'codec': values.get('ID_AUDIO_CODEC') or values.get('ID_AUDIO_FORMAT'),
+					'channels': int(values.get('ID_AUDIO_NCH', 0)) or None, 'rate': int(values.get('ID_AUDIO_RATE', 0)) or None}] \
+				if 'ID_AUDIO_ID' in values or 'ID_AUDIO_FORMAT' in values else []
+		return self.Info(width, height, sar, ParseRatio(values.get('ID_VIDEO_FPS', '')), None,
+							values.get('ID_VIDEO_FORMAT'), audio, 'mplayer')
+
+###
+# HTTP connection pool
+###
+class HTTPConnectionPool:
+	"""
+	keeps connections alive between requests, keyed by host;
+	failed idempotent requests are retried with an exponential backoff, others
+	only if sending them on a kept alive connection failed
+	"""
+	def __init__(self, timeout=30, retries=3, backoff=0.5, headers=None):
+		self.timeout = timeout
+		self.retries = retries
+		self.backoff = backoff
+		self.headers = dict(headers or {})
+		
+		self.lock = threading.Lock()
+		self.idle = {}
+	
+	def Acquire(self, scheme, host):
+		""" returns (connection, reused) """
+		with self.lock:
+			connections = self.idle.get((scheme, host))
+			if connections:
+				return connections.pop(), True
+		connectionclass = httplib.HTTPSConnection if scheme == 'https' else httplib.HTTPConnection
+		return connectionclass(host, timeout=self.timeout), False
+	
+	def Release(self, scheme, host, connection):
+		with self.lock:
+			self.idle.setdefault((scheme, host), []).append(connection)
+	
+	def Request(self, method, url, body=None, headers=None, redirects=5, idempotent=None):
+		"""
+		returns (status, reason, data); idempotent defaults to True for GET and HEAD,
+		a request with side effects (upload, rating) has to pass False
+		"""
+		allheaders = dict(self.headers)
+		allheaders.update(headers or {})
+		attempt = 0
+		
+		while True:
+			scheme, host, path, query, _ = urlparse.urlsplit(url)
+			selector = "%s?%s" % (path or '/', query) if query else (path or '/')
+			retry = method in ('GET', 'HEAD') if idempotent is None else idempotent
+			
+			connection, reused = self.Acquire(scheme, host)
+			sent = False
+			try:
+				connection.request(method, selector, body, allheaders)
+				sent = True
+				response = connection.getresponse()
+				data = response.read()
+			except (socket.error, httplib.HTTPException), e:
+				connection.close()
+				if reused and (retry or not sent):
+					# the server closed the kept alive connection, try a fresh one
+					Debug(4, "HTTPConnectionPool: stale connection to %s: %r" % (host, e))
+					continue
+				if not retry or attempt >= self.retries:
+					raise IOError("Request to '%s' failed: %s" % (url, e))
+				attempt += 1
+				Debug(2, "HTTPConnectionPool: %s failed (%r), retry %d in %.1fs" % (url, e, attempt, self.backoff * 2**(attempt-1)))
+				time.sleep(self.backoff * 2**(attempt-1))
+				continue
+			
+			if response.will_close:
+				connection.close()
+			else:
+				self.Release(scheme, host, connection)
+			
+			if response.status in (301, 302, 303, 307) and redirects > 0 and response.getheader('location'):
+				url = urlparse.urljoin(url, response.getheader('location'))
+				Debug(4, "HTTPConnectionPool: redirected to %s" % url)
+				if response.status != 307:
+					method, body = 'GET', None
+				redirects -= 1
+				continue
+			if response.status >= 500 and attempt < self.retries and retry:
+				attempt += 1
+				Debug(2, "HTTPConnectionPool: %s returned %d, retry %d in %.1fs" % (url, response.status, attempt, self.backoff * 2**(attempt-1)))
+				time.sleep(self.backoff * 2**(attempt-1))
+				continue
+			
+			return response.status, response.reason, data
+	
+	def Get(self, url, idempotent=None):
+		status, reason, data = self.Request('GET', url, idempotent=idempotent)
+		if status >= 400:
+			raise IOError("HTTP Error %d: %s (%s)" % (status, reason, url))
+		return data
+
 ###
 # post multipart method
 # credit: http://code.activestate.com/recipes/146306-http-client-to-post-using-multipartform-data/
 ###
-def post_multipart(host, selector, fields, files):
+def post_multipart(host, selector, fields, files, pool=None):
 	"""
 	Post fields and files to an http host as multipart/form-data.
 	fields is a sequence of (name, value) elements for regular form fields.
 	files is a sequence of (name, filename, value) elements for data to be uploaded as files
+	pool is an optional HTTPConnectionPool to send the request with
 	Return the server's response.
 	"""
 	content_type, body = encode_multipart_formdata(fields, files)
@@ -513,6 +1559,8 @@ def post_multipart(host, selector, fields, files):
 		'User-Agent': prog_id,
 		'Content-Type': content_type
 		}
+	if pool:
+		return pool.Request('POST', "http://%s%s" % (host, selector), body, headers)
 	h = httplib.HTTPConnection(host)
 	h.request('POST', selector, body, headers)
 	res = h.getresponse()
@@ -547,41 +1595,285 @@ def encode_multipart_formdata(fields, files):
 def get_content_type(filename):
     return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
 
+###
+# cutlist parser
+###
+cutlist_section_re = re.compile(r"\[(?P<section>[^\]]*)\]$")
+cutlist_integer_re = re.compile(r"[-0-9]*")
+cutlist_float_re = re.compile(r"[-0-9.]*")
+cutlist_cutsection_re = re.compile(r"cut[0-9]+$", re.I)
+
+class CutListParseError(ValueError):
+	"""
+	problem in the text of a cutlist, knows the section, line and field concerned
+	"""
+	def __init__(self, text, section=None, line=None, field=None):
+		ValueError.__init__(self, text)
+		self.text = text
+		self.section = section
+		self.line = line
+		self.field = field
+	
+	def __unicode__(self):
+		location = []
+		if self.section is not None:	location.append(u"[%s]" % self.section)
+		if self.line is not None:		location.append(u"Zeile %d" % self.line)
+		if self.field is not None:		location.append(self.field)
+		return u"Cutlist %s: %s" % (u" ".join(location), self.text) if location else u"Cutlist: %s" % self.text
+	
+	def __str__(self):
+		return unicode(self).encode('utf-8')
+
+def ParseCutList(cutlisttxt, warnings=None):
+	"""
+	parses the text of a cutlist in a single pass and returns its cutlist_dict;
+	raises CutListParseError if the cutlist is unusable, recoverable problems
+	are appended to warnings
+	"""
+	if warnings is None:
+		warnings = []
+	
+	general = {} # key -> (value, line, section), the first occurrence wins
+	cuts = []    # [(section, line, {key -> (value, line)})]
+	current = general
+	section = None
+	for lineno, line in enumerate(cutlisttxt.splitlines(), 1):
+		line = line.strip()
+		if not line or line[0] in ";#":
+			continue
+		
+		if line[0] == '[':
+			match = cutlist_section_re.match(line)
+			if not match:
+				warnings.append(CutListParseError(u"ungültige Abschnittsüberschrift '%s'" % line, line=lineno))
+				continue
+			section = match.group('section')
+			if cutlist_cutsection_re.match(section):
+				current = {}
+				cuts.append( (section, lineno, current) )
+			else:
+				current = general
+			continue
+		
+		key, sep, value = line.partition('=')
+		if not sep:
+			warnings.append(CutListParseError(u"Zeile ohne '=' ignoriert", section, lineno))
+			continue
+		key = key.strip()
+		if key not in current:
+			current[key] = (value.strip(), lineno, section)
+	
+	def number(entries, key, pattern, convert):
+		value, lineno, section = entries[key]
+		try:
+			return convert(pattern.match(value).group())
+		except ValueError:
+			raise CutListParseError(u"ungültige Zahl '%s'" % value, section, lineno, key)
+	
+	cutlist_dict = {}
+	# fps
+	if "FramesPerSecond" not in general:
+		raise CutListParseError(u"FramesPerSecond fehlt", field="FramesPerSecond")
+	cutlist_dict["fps"] = number(general, "FramesPerSecond", cutlist_float_re, float)
+	# file
+	if "ApplyToFile" in general:
+		cutlist_dict["file"] = general["ApplyToFile"][0]
+	else:
+		warnings.append(CutListParseError(u"ApplyToFile fehlt", field="ApplyToFile"))
+	# suggested file name
+	if "SuggestedMovieName" in general:
+		cutlist_dict["suggested"] = general["SuggestedMovieName"][0]
+	# file size
+	if "OriginalFileSizeBytes" not in general:
+		raise CutListParseError(u"OriginalFileSizeBytes fehlt", field="OriginalFileSizeBytes")
+	cutlist_dict["size"] = number(general, "OriginalFileSizeBytes", cutlist_integer_re, int)
+	if cutlist_dict["size"] < 0:
+		warnings.append(CutListParseError(u"negative Dateigröße, Autokorrektur", general["OriginalFileSizeBytes"][2],
+								general["OriginalFileSizeBytes"][1], "OriginalFileSizeBytes"))
+		cutlist_dict["size"] += 2**32
+	
+	# timings, frame numbers are preferred over seconds
+	fps = cutlist_dict["fps"]
+	frames = []
+	for section, lineno, cut in cuts:
+		if "StartFrame" in cut and "DurationFrames" in cut:
+			start = number(cut, "StartFrame", cutlist_integer_re, int)
+			duration = number(cut, "DurationFrames", cutlist_integer_re, int)
+		elif "Start" in cut and "Duration" in cut:
+			start = int( number(cut, "Start", cutlist_float_re, float) * fps + 0.5 )
+			duration = int( number(cut, "Duration", cutlist_float_re, float) * fps + 0.5 )
+		else:
+			raise CutListParseError(u"Start oder Dauer fehlt", section, lineno)
+		if duration < 0:
+			warnings.append(CutListParseError(u"negative Zeitdauer, Autokorrektur", section, lineno))
+			start, duration = start + duration, -duration
+		frames.append( (start, duration) )
+	cutlist_dict["frames"] = frames
+	
+	return cutlist_dict
+
+def ValidateCutList(cutlist_dict, size, info):
+	"""
+	compares a parsed cutlist with the recording: file size, fps and the end of the
+	last cut against the frame count (info from MediaProbe, may be None);
+	returns the mismatches as list of strings, empty if the cutlist fits
+	"""
+	problems = []
+	if size is not None and cutlist_dict["size"] != size:
+		problems.append(u"Dateigröße %d statt %d Bytes" % (cutlist_dict["size"], size))
+	if not info:
+		return problems
+	
+	fps = cutlist_dict["fps"]
+	if info['fps'] and abs(fps - info['fps']) > 0.01:
+		problems.append(u"%g statt %g fps" % (fps, info['fps']))
+	if info['frames'] and info['fps'] and fps > 0 and cutlist_dict["frames"]:
+		# compare in seconds, the frame numbers of the cutlist are relative to its fps
+		end = max(start + duration for start, duration in cutlist_dict["frames"]) / fps
+		length = info['frames'] / info['fps']
+		if end > length + 1:
+			problems.append(u"letzter Schnitt endet bei %d s, die Aufnahme ist %d s lang" % (end, length))
+	return problems
+
+###
+# cutlist search result parser
+###
+cutlist_search_re = re.compile('<cutlist row_index="\\d+">.*?</cutlist>', re.DOTALL)
+cutlist_xmldecl_re = re.compile(r"^\s*<\?xml[^>]*\?>")
+cutlist_meta_re = re.compile("<(?P<tag>.*?)>\s*(?P<value>.*?)\s*</(?P=tag)>", re.DOTALL)
+
+def IterCutListMeta(xml):
+	"""
+	parses a getxml.php response incrementally and yields the meta information
+	of each cutlist as dict in document order; if the response is malformed or
+	truncated, the remaining cutlists are extracted with regular expressions
+	"""
+	# the response is already decoded, so the declared encoding must not be applied again
+	if isinstance(xml, unicode):
+		xml = xml.encode("utf-8")
+	xml = cutlist_xmldecl_re.sub("", xml, 1)
+	if not xml.strip():
+		return
+	
+	count = 0
+	try:
+		attr = None
+		for event, elem in ElementTree.iterparse(cStringIO.StringIO(xml), ("start","end")):
+			if elem.tag == "cutlist":
+				if event == "start":
+					attr = {}
+				else:
+					if attr and 'id' in attr:
+						count += 1
+						yield attr
+					attr = None
+					elem.clear()
+			elif event == "end" and attr is not None:
+				attr[elem.tag] = unicode(elem.text or "").strip()
+		return
+	except SyntaxError, e:
+		Debug(1, "IterCutListMeta: malformed response after %d cutlist(s): %s" % (count, e))
+	
+	# fallback for the cutlists the xml parser did not get to
+	for i, match in enumerate(cutlist_search_re.finditer(xml)):
+		if i >= count:
+			attr = dict(cutlist_meta_re.findall(match.group()))
+			if 'id' in attr:
+				yield dict((tag, unicode(value, "utf-8", "replace")) for tag, value in attr.iteritems())
+
 ###
 # CutList Class
 ###
-class CutList:
+class CutListMeta(object):
+	"""
+	meta information of a cutlist, behaves like the dict of the cutlist.at tags
+	but stores only the known fields; absent fields are None
+	"""
+	#tags:
+	# 'id', 'name', 'rating', 'ratingcount', 'author', 'ratingbyauthor', 'actualcontent', 'usercomment', 'cuts', 'filename', 
+	# 'filename_original', 'autoname', 'withframes', 'withtime', 'duration', 'errors', 'othererrordescription', 'downloadcount'
+	__slots__ = ('id', 'name', 'rating', 'ratingcount', 'author', 'ratingbyauthor', 'actualcontent', 'usercomment', 'cuts', 'filename',
+				'filename_original', 'autoname', 'withframes', 'withtime', 'duration', 'errors', 'othererrordescription', 'downloadcount',
+				'metarating')
+	
+	def __init__(self, tags):
+		for key in self.__slots__:
+			setattr(self, key, None)
+		for key, value in tags.iteritems():
+			if key in self.__slots__:
+				setattr(self, key, value)
+		
+		#
+		# create metarating
+		#
+		def ToF(a, default):
+			try:	return float(a)
+			except:	return default
+		if self.rating is not None and self.ratingbyauthor is not None and self.ratingcount is not None and self.downloadcount is not None:
+			self.metarating = ToF(self.rating,0) \
+							+ ToF(self.ratingbyauthor,-1) \
+							+ ToF(self.ratingcount,0)/50 \
+							+ ToF(self.downloadcount,0)/1000
+		else:
+			self.metarating = ToF(self.metarating, 0.)
+	
+	def __contains__(self, key):
+		return key in self.__slots__ and getattr(self, key) is not None
+	
+	def __getitem__(self, key):
+		if key not in self:
+			raise KeyError(key)
+		return getattr(self, key)
+	
+	def __setitem__(self, key, value):
+		if key not in self.__slots__:
+			raise KeyError(key)
+		setattr(self, key, value)
+
+class CutTimes(object):
+	"""
+	cuts of a cutlist as compact frame arrays, the views in seconds are computed once
+	"""
+	__slots__ = ('fps', 'starts', 'durations', 'seconds')
+	
+	def __init__(self, fps, frames):
+		self.fps = fps
+		self.starts = array('l', [start for start, duration in frames])
+		self.durations = array('l', [duration for start, duration in frames])
+		self.seconds = None
+	
+	def __len__(self):
+		return len(self.starts)
+	
+	def Frames(self):
+		return self.starts, self.durations
+	
+	def Seconds(self):
+		if self.seconds is None:
+			fps = self.fps
+			self.seconds = tuple(start/fps for start in self.starts), tuple(duration/fps for duration in self.durations)
+		return self.seconds
+	
+	def AsTuples(self):
+		return zip(self.starts, self.durations)
+
+class CutList(object):
 	"""
 	encapsulates a cutlist (with some meta information) and some common operations,
 	like viewing cutlist and showing metadata
 	"""
+	__slots__ = ('cutlistprov', 'attr', 'cutlist_dict', 'times', 'lock', 'keyframes', 'problems', 'warnings')
+	
 	def __init__(self, cutlistprov, cutlist_meta_xml=None, cutlist_meta_dict=None, cutlist_dict=None):
 		self.cutlistprov = cutlistprov
 		
 		if cutlist_meta_xml:
-			#tags:
-			# 'id', 'name', 'rating', 'ratingcount', 'author', 'ratingbyauthor', 'actualcontent', 'usercomment', 'cuts', 'filename', 
-			# 'filename_original', 'autoname', 'withframes', 'withtime', 'duration', 'errors', 'othererrordescription', 'downloadcount'
-			tagvalues = re.findall("<(?P<tag>.*?)>\s*(?P<value>.*?)\s*</(?P=tag)>", cutlist_meta_xml, re.DOTALL) #python is so cool
-			self.attr = dict(tagvalues)
+			tagvalues = cutlist_meta_re.findall(cutlist_meta_xml) #python is so cool
+			self.attr = CutListMeta(dict(tagvalues))
 		elif cutlist_meta_dict:
-			self.attr = dict(cutlist_meta_dict)
+			self.attr = CutListMeta(cutlist_meta_dict)
 		else:
 			raise ValueError("CutList was called with illegal arguments.")
-		
-		#
-		# create metarating
-		#
-		if 'rating' in self.attr and 'ratingbyauthor' in self.attr and 'ratingcount' in self.attr and 'downloadcount' in self.attr:
-			def ToF(a, default):
-				try:	return float(a)
-				except:	return default
-			self.attr["metarating"] = ToF(self.attr['rating'],0) \
-									+ ToF(self.attr['ratingbyauthor'],-1) \
-									+ ToF(self.attr['ratingcount'],0)/50 \
-									+ ToF(self.attr['downloadcount'],0)/1000
-		else:
-			self.attr["metarating"] = 0.
 	
 		#
 		# init cutlist dict (lazy!)
@@ -593,6 +1885,12 @@ class CutList:
 			self.cutlist_dict = dict(cutlist_dict)
 		else: 
 			self.cutlist_dict = {}
+		self.times = None
+		self.keyframes = None
+		self.problems = None
+		self.warnings = []
+		# the cutlist may be downloaded and parsed in the background
+		self.lock = threading.Lock()
 	
 	def __contains__(self, key):
 		return key in self.attr
@@ -608,59 +1906,63 @@ class CutList:
 		return self.cutlistprov.GetCutList(self.attr["id"])
 		
 	def __GetCutList(self):
-		if not self.cutlist_dict:
-			cutlisttxt = self.GetRawCutList()
-			# extract fps
-			self.cutlist_dict["fps"] = float( re.search("FramesPerSecond=(?P<value>[-0-9.]*)", cutlisttxt).group('value') )
-			# extract file
-			try: self.cutlist_dict["file"] = re.search("ApplyToFile=(?P<value>.*)", cutlisttxt).group('value').strip()
-			except: print "Conversion: Filename not found:\n%s" % cutlisttxt
-			# extract suggested file name
-			try: self.cutlist_dict["suggested"] = re.search("SuggestedMovieName=(?P<value>.*)", cutlisttxt).group('value').strip()
-			except: print "Conversion: SuggestedMovieName not found:\n%s" % cutlisttxt
-			# extract file size
-			try: self.cutlist_dict["size"] = int( re.search("OriginalFileSizeBytes=(?P<value>[-0-9.]*)", cutlisttxt).group('value') )
-			except: print "Conversion: Filesize not found:\n%s" % cutlisttxt
-			if self.cutlist_dict["size"] < 0:
-				print "Warnung: Cutlist listet eine negative Dateigröße. Autokorrektur."
-				self.cutlist_dict["size"] += 2**32
-			
-			# extract timings
-			if "\nStartFrame" in cutlisttxt:
-				StartInFrames = re.findall("StartFrame=(?P<value>[-0-9]*)", cutlisttxt)
-				StartInFrames = [int(d) for d in StartInFrames]
-				DurationInFrames= re.findall("DurationFrames=(?P<value>[-0-9]*)", cutlisttxt)
-				DurationInFrames = [int(d) for d in DurationInFrames]
-			else:
-				fps = self.cutlist_dict["fps"]
-				Start = re.findall("Start=(?P<value>[-0-9.]*)", cutlisttxt)
-				StartInFrames = [int( float(d) * fps + 0.5 ) for d in Start]
-				Duration = re.findall("Duration=(?P<value>[-0-9.]*)", cutlisttxt)
-				DurationInFrames = [int( float(d) * fps + 0.5 ) for d in Duration]
-			for i, duration in enumerate(DurationInFrames):
-				if duration < 0:
-					print "Warnung: Cutlist listet negative Zeitdauern. Autokorrektur."
-					StartInFrames[i] += duration
-					DurationInFrames[i] = -duration
-			self.cutlist_dict["frames"] = zip(StartInFrames, DurationInFrames)
-			
+		with self.lock:
+			if not self.cutlist_dict:
+				self.cutlist_dict = self.__ParseCutList(self.GetRawCutList())
 		return self.cutlist_dict
 	
+	def __ParseCutList(self, cutlisttxt):
+		# may run in a prefetch thread, the warnings are printed by PrintWarnings
+		return ParseCutList(cutlisttxt, self.warnings)
+	
+	def PrintWarnings(self):
+		""" prints the warnings of the parser once, has to be called from the main thread """
+		while self.warnings:
+			print "Warnung: %s" % self.warnings.pop(0)
+	
 	def GetCutListDict(self):
 		return self.__GetCutList()
 	
+	def IsLoaded(self):
+		""" whether the cutlist itself is downloaded and parsed """
+		return bool(self.cutlist_dict)
+	
 	def GetFPS(self):
 		return self.__GetCutList()["fps"]
+	
+	def GetCutTimes(self):
+		if self.times is None:
+			cutlist = self.__GetCutList()
+			self.times = CutTimes(cutlist["fps"], cutlist["frames"])
+		return self.times
 
 	def TimesInFrames(self):
-		frames = self.__GetCutList()["frames"]
-		return [start for start, duration in frames], [duration for start, duration in frames]
+		return self.GetCutTimes().Frames()
 	
 	def TimesInSeconds(self):
-		cutlist = self.__GetCutList()
-		fps = cutlist["fps"]
-		frames = cutlist["frames"]
-		return [start/fps for start, duration in frames], [duration/fps for start, duration in frames]
+		return self.GetCutTimes().Seconds()
+
+	def AnnotateKeyframes(self, index):
+		"""
+		stores for every cut the distances of its start and end to the nearest keyframes
+		of the recording (AviIndex) and the number of frames to be re-encoded
+		"""
+		distances = []
+		reencode = 0
+		for start, duration in zip(*self.TimesInFrames()):
+			distances.append( (index.KeyframeDistance(start), index.KeyframeDistance(start + duration)) )
+			reencode += index.ReencodeFrames(start, duration)
+		self.keyframes = (distances, reencode)
+		return reencode
+
+	def Validate(self, path, info):
+		""" checks the cutlist against the recording (see ValidateCutList) and stores the mismatches """
+		try:
+			size = os.path.getsize(path)
+		except OSError:
+			size = None
+		self.problems = ValidateCutList(self.GetCutListDict(), size, info)
+		return self.problems
 
 	def GenerateRawCutList(self):
 		cutlist = self.__GetCutList()
@@ -806,42 +2108,52 @@ class CutList:
 		if self.attr["usercomment"]:
 			outtxt += "	Kommentar: @BLUE %s @CLEAR\n" % self.attr["usercomment"]
 		
+		if self.keyframes:
+			distances, reencode = self.keyframes
+			ontarget = sum(1 for start, end in distances if start == 0)
+			outtxt += u"	Keyframes: @BLUE %d/%d Schnitte auf Keyframes, ca. %d Frames neu kodieren @CLEAR (Abstände: %s)\n" \
+						% (ontarget, len(distances), reencode, ", ".join("%+d/%+d" % (start, end) for start, end in distances if start is not None and end is not None))
+		
+		if self.problems:
+			outtxt += u"	Passt nicht: @RED %s @CLEAR\n" % ", ".join(self.problems)
+		
 		return outtxt.replace("@BLUE",C_BLUE).replace("@RED",C_RED).replace("@CLEAR",C_CLEAR).replace("@BLACK",C_BLACK)
 		
-	def ShowCuts(self, path, is_filecut, tempdir):
-		fps = self.GetFPS()
+	def IterTimeline(self, is_filecut):
+		"""
+		yields the discarded ranges (start, end) and the cut boundaries (name, time),
+		each as tuple (discard, countdown) with one of them None
+		"""
 		Start, Duration = self.TimesInSeconds()
 		
 		time_before_cut = self.cutlistprov.cutoptions.time_before_cut
 		time_after_cut  = self.cutlistprov.cutoptions.time_after_cut
 		
-		discard = []
-		countdown = []
-		
 		if is_filecut:
-			for i in range(len(Duration)):
-				ith_cut = sum( Duration[:i] )
-				ippth_cut = sum( Duration[:i+1] )
-				discard.append( ( ith_cut + time_after_cut, ippth_cut - time_before_cut) )
-				countdown.append( ("Schnitt #%d" % (i+1),ippth_cut) )
-		else:
-			discard.append((0, max(0,Start[0]-time_before_cut)))
-			countdown.append( ("Schnitt #0.Post", Start[0]) )
+			# cut positions in the cut file are the prefix sums of the durations
+			ith_cut = 0.
+			for i, duration in enumerate(Duration):
+				ippth_cut = ith_cut + duration
+				yield ( ith_cut + time_after_cut, ippth_cut - time_before_cut), None
+				yield None, ("Schnitt #%d" % (i+1), ippth_cut)
+				ith_cut = ippth_cut
+		elif Start:
+			yield (0, max(0,Start[0]-time_before_cut)), None
+			yield None, ("Schnitt #0.Post", Start[0])
 			
 			for i in range(len(Start)):
-				discard.append( ( Start[i] + time_after_cut, Start[i] + Duration[i] - time_before_cut) )
+				yield ( Start[i] + time_after_cut, Start[i] + Duration[i] - time_before_cut), None
 				
-				countdown.append( ("Schnitt #%d.Pre" % (i+1), Start[i] + Duration[i]) )
+				yield None, ("Schnitt #%d.Pre" % (i+1), Start[i] + Duration[i])
 				if i + 1 < len(Start):
-					discard.append( ( Start[i] + Duration[i], Start[i+1] - time_before_cut) )
-					countdown.append( ("Schnitt #%d.Post" % (i+1), Start[i+1] ) )
+					yield ( Start[i] + Duration[i], Start[i+1] - time_before_cut), None
+					yield None, ("Schnitt #%d.Post" % (i+1), Start[i+1])
 				else:
-					discard.append( (Start[i] + Duration[i], 10 * 3600) ) # assume: length < 10h
-				
-
-		edl = "\n".join(["%f\t%f\t0" % (s,e) for s,e in discard])
-		sub = ""
-		
+					yield (Start[i] + Duration[i], 10 * 3600), None # assume: length < 10h
+	
+	def IterSubtitle(self, countdown):
+		""" yields the MicroDVD lines of a countdown from -15s until 15s around each cut """
+		fps = self.GetFPS()
 		pre_frames  = int( (12./25.) * fps + 0.5)
 		post_frames = int( (13./25.) * fps + 0.5)
 		for txt,time in countdown:
@@ -851,16 +2163,25 @@ class CutList:
 				elif i == 0:text = "=->SCHNITT<-="
 				elif i > 0:	text = "%ds nach %s" % (i,txt)
 				
-				sub += "{%d}{%d}%s\n" % (frame-pre_frames,frame+post_frames,text)
-			
+				yield "{%d}{%d}%s\n" % (frame-pre_frames,frame+post_frames,text)
+	
+	def ShowCuts(self, path, is_filecut, tempdir):
 		filename = os.path.basename(path)
 		d = random.getrandbits(32)
 		edlfile = os.path.join(tempdir, "%d_%s.edl" % (d,filename))
 		subfile = os.path.join(tempdir, "%d_%s.sub" % (d,filename))
-		open(edlfile,"w").write(edl)
-		open(subfile,"w").write(sub)
+		
+		countdown = []
+		with open(edlfile,"w") as edl:
+			for discard, boundary in self.IterTimeline(is_filecut):
+				if discard:
+					edl.write("%f\t%f\t0\n" % discard)
+				else:
+					countdown.append(boundary)
+		with open(subfile,"w") as sub:
+			sub.writelines(self.IterSubtitle(countdown))
 			
-		Run("mplayer", ["-edl", edlfile, "-sub", subfile, "-osdlevel", "3", path])
+		Run("mplayer", ["-edl", edlfile, "-sub", subfile, "-osdlevel", "3", path], collect = False)
 	
 	def PostProcessCutList(self):
 		self.cutlistprov.PostProcessCutList( self.attr["id"], self )
@@ -873,40 +2194,73 @@ class CutListAT:
 	Wrapper for cutlist.at
 	"""
 	def __init__(self, cutoptions):
-		self.opener = urllib2.build_opener()
-		self.opener.addheaders = [ ('User-agent', prog_id)]
+		self.pool = cutoptions.httppool
 		self.cutoptions = cutoptions
 		
 		self.desc = "Cutlists von Cutlist.at herunterladen."
 		
-		self.cutlistCache = FileCache("cutlist", cutoptions.cachedir, self._GetCutList,
-								cutlist_expire_period, lambda x: Debug(2, x))
-		self.searchCache = FileCache("search", cutoptions.cachedir, self._GetSearchList,
-								search_request_expire_period, lambda x: Debug(2, x))
-		self.commentsCache = FileCache("comments", cutoptions.cachedir, self._GetComments,
-								comments_expire_period, lambda x: Debug(2, x))
+		self.cutlistCache = CreateFileCache("cutlist", cutoptions, self._GetCutList, cutlist_expire_period)
+		self.searchCache = CreateFileCache("search", cutoptions, self._GetSearchList, search_request_expire_period)
+		self.commentsCache = CreateFileCache("comments", cutoptions, self._GetComments, comments_expire_period)
+		self.caches = [self.cutlistCache, self.searchCache, self.commentsCache]
 
-	def Get(self, url, user=False):
+	def Get(self, url, user=False, idempotent=None):
 		userhash = self.cutoptions.cutlistathash
 		if user and userhash:
 			url = "http://www.cutlist.at/user/%s/%s" % (userhash,url)
 		else:
 			url = "http://www.cutlist.at/%s" % url
 		Debug(4,"get url: %s"%url)
-		return self.opener.open(url).read()
+		return self.pool.Get(url, idempotent)
 		
 	def _GetSearchList(self, filename):
 		url = "getxml.php?name=%s&version=0.9.8.0" % filename
 		return unicode(self.Get(url), "iso-8859-1")
+	def IterAll(self, filename):
+		""" yields the cutlists for filename lazily in the order of the response """
+		found = False
+		for attr in IterCutListMeta(self.searchCache.get(filename)):
+			found = True
+			yield CutList(self,cutlist_meta_dict=attr)
+		if not found and '_TVOON_DE' in filename:
+			for cutlist in self.IterAll(filename.split('_TVOON_DE')[0]):
+				yield cutlist
 	def ListAll(self, filename):
-		xml = self.searchCache.get(filename)
-		cutlists = re.findall('<cutlist row_index="\\d">.*?</cutlist>', xml, re.DOTALL)
-		if cutlists:
-			return [CutList(self,cutlist_meta_xml=cutlist) for cutlist in cutlists]
+		return list(self.IterAll(filename))
+	
+	def GetSearchName(self, filename):
+		if not self.cutoptions.cutlistatall:
+			return filename
 		else:
-			return self.ListAll(filename.split('_TVOON_DE')[0]) if '_TVOON_DE' in filename else []
-		
-		
+			return filename.split('_TVOON_DE')[0]
+	
+	def Prefetch(self, paths):
+		""" fills the search and comments caches for all files concurrently """
+		def prefetch(path):
+			filename = os.path.basename(path)
+			try:
+				cutlists = self.ListAll(self.GetSearchName(filename))
+				if not self.cutoptions.no_comments:
+					self.commentsCache.get(filename)
+				cutlists.sort(key = lambda x: -float(x['metarating']))
+				for cutlist in cutlists[:self.cutoptions.prefetchcutlists]:
+					self.cutlistCache.get(cutlist['id'])
+			except StandardError, e:
+				Debug(1, "CutListAT::Prefetch: '%s' failed: %s" % (filename, e))
+		ParallelMap(prefetch, paths, self.cutoptions.prefetchworkers)
+	
+	def PrefetchCutLists(self, cutlists):
+		""" downloads and parses the best rated cutlists in the background """
+		def prefetch(cutlist):
+			try:
+				cutlist.GetCutListDict()
+			except StandardError, e:
+				Debug(1, "CutListAT::PrefetchCutLists: '%s' failed: %s" % (cutlist['id'], e))
+		cutlists = cutlists[:self.cutoptions.prefetchcutlists]
+		if cutlists:
+			thread = threading.Thread(target=ParallelMap, args=(prefetch, cutlists, len(cutlists)))
+			thread.daemon = True
+			thread.start()
 	
 	def _GetCutList(self, cl_id):
 		url = "getfile.php?id=%s" % cl_id
@@ -917,13 +2271,13 @@ class CutListAT:
 	def RateCutList(self, cl_id, rating):
 		Debug(2, "rate cutlist %s with %d" % (cl_id, rating))
 		url = "rate.php?rate=%s&rating=%d" % (cl_id, rating)
-		return self.Get(url,user=True)
+		return self.Get(url,user=True,idempotent=False) # a retry could vote twice
 	
 	def _GetComments(self, filename):
 		url = "http://www.onlinetvrecorder.com/recording_comment.php?shortview=true&filename=%s" % filename
 		Debug(4, "_GetComments: Rufe URL '%s' auf um die Kommentare auszulesen." % url)
 		try:
-			comments = self.opener.open(url).read()
+			comments = self.pool.Get(url)
 		except StandardError, e:
 			Debug(1, "_GetComments: Fehler: Konnte URL '%s' nicht aufrufen wegen: %s" % (url,e))
 			return ""
@@ -941,23 +2295,54 @@ class CutListAT:
 				
 				print "Hole Übersicht von cutlist.at..."
 
-				if not prov.cutoptions.cutlistatall:
-					searchname = filename
-				else:
+				if prov.cutoptions.cutlistatall:
 					print " %s Warnung: %s Es werden Cutlists für jegliche Qualität geladen. Dies kann zu Problemen führen."%(C_RED,C_CLEAR)
-					searchname = filename.split('_TVOON_DE')[0]
-				self.cutlists = prov.ListAll(searchname)
+				self.cutlists = prov.ListAll(prov.GetSearchName(filename))
 				print "%d Cutlist(s) gefunden" % len(self.cutlists)
 
 				if len(self.cutlists) == 0:
 					raise LookupError()
 				
 				self.cutlists.sort(key =  lambda x: -float(x['metarating']))
+				if prov.cutoptions.keyframeinfo:
+					self.annotateKeyframes()
+				if prov.cutoptions.validatecutlists:
+					self.validate()
+				prov.PrefetchCutLists(self.cutlists)
 
 				print
 				for i, cutlist in enumerate(self.cutlists):
 					print cutlist.CutListToConsoleText(i+1)
 
+			def annotateKeyframes(self):
+				try:
+					index = prov.cutoptions.aviindexcache.get(path)
+				except (EnvironmentError, ValueError, struct.error, OverflowError), e:
+					Debug(1, "CutListAT::annotateKeyframes: no keyframes for '%s': %s" % (path, e))
+					return
+				
+				def annotate(cutlist):
+					reencode = cutlist.AnnotateKeyframes(index)
+					if prov.cutoptions.keyframepenalty:
+						cutlist['metarating'] -= prov.cutoptions.keyframepenalty * reencode / cutlist.GetFPS()
+				print "Lade Cutlists für die Keyframeanalyse..."
+				ParallelMap(annotate, self.cutlists, max(1, prov.cutoptions.prefetchworkers))
+				self.cutlists.sort(key =  lambda x: -float(x['metarating']))
+
+			def validate(self):
+				# only cutlists which are already loaded (e.g. for keyframeinfo=), the
+				# chosen cutlist is checked in CutFile.ChooseCutList
+				loaded = [cutlist for cutlist in self.cutlists if cutlist.IsLoaded()]
+				if not loaded:
+					return
+				try:
+					info = prov.cutoptions.mediaprobe.Get(path)
+				except (EnvironmentError, ValueError), e:
+					Debug(1, "CutListAT::validate: no media information for '%s': %s" % (path, e))
+					return
+				for cutlist in loaded:
+					cutlist.Validate(path, info)
+
 			def getCutlist(self, inp, **kwargs):
 				try:
 					i = int(inp)-1
@@ -1024,7 +2409,7 @@ class CutListAT:
 					print "Illegale Eingabe"
 
 	@staticmethod
-	def UploadCutList(cutlistathash, cutlist):
+	def UploadCutList(cutlistathash, cutlist, pool=None):
 		fname = [line for line in cutlist.split('\n') if line.startswith("ApplyToFile=")]
 		if len(fname) != 1:
 			print "Illegale Cutlist, uploaden nicht möglich."
@@ -1037,7 +2422,7 @@ class CutListAT:
 		files = [ ("userfile[]", fname + '.cutlist', cutlist.replace('\n','\r\n')) ]
 		
 		try:
-			response = post_multipart(host, selector, fields, files)
+			response = post_multipart(host, selector, fields, files, pool)
 		except Exception, e:
 			print "Upload ist fehlgeschlagen: %s" % e
 			return
@@ -1062,7 +2447,8 @@ class CutListOwnProvider:
 		self.cutoptions = cutoptions
 		self.desc = "Eigene Cutlists erstellen."
 		
-		self.cutlistCache = FileCache("mycutlists", cutoptions.cachedir, lambda x: "", None, lambda x: Debug(2, x))
+		self.cutlistCache = CreateFileCache("mycutlists", cutoptions, lambda x: "", pinned=True)
+		self.caches = [self.cutlistCache]
 		self.delimiter = "66b29df4086fd34e6c63631553132e8421d5fe3698ba5120358ee31ffed9b518e61d0b0ed6a583ec1fd7367aab7af928196391f3131929\n"
 	
 	def getCutlists(self, filename):
@@ -1147,7 +2533,7 @@ class CutListOwnProvider:
 
 		cutlisttxt = cutlist.GenerateCompleteCutList()
 		if cutlisttxt:
-			CutListAT.UploadCutList(self.cutoptions.cutlistathash, cutlisttxt)
+			CutListAT.UploadCutList(self.cutoptions.cutlistathash, cutlisttxt, self.cutoptions.httppool)
 		else:
 			print
 			print "Vorgang abgebrochen, die Cutlist wird nicht hochgeladen!"
@@ -1276,6 +2662,11 @@ class CutOptions:
 		self.cutdirformat = os.getcwd()
 		self.uncutdir= os.getcwd()
 		self.cachedir= os.path.expanduser("~/.cache/multicut_evolution/")
+		self.cachebackend = "files"
+		self.cachecompression = True
+		self.cachegcinterval = datetime.timedelta(hours=24)
+		self.memorycacheentries = 200
+		self.memorycachebytes = 16 * 2**20
 		self.author  = pwd.getpwuid(os.getuid())[0]
 		self.only_internet = bool(options.only_internet) if options else False
 		self.no_internet = bool(options.no_internet) if options else False
@@ -1294,6 +2685,20 @@ class CutOptions:
 		self.convertonlywac3tomkv = False
 		self.delavi = False
 		self.useac3 = True
+		self.smartcopy = False
+		self.renderworkers = 1
+		self.keyframeinfo = False
+		self.keyframepenalty = 0.
+		self.validatecutlists = True
+		self.processtimeout = 0
+		self.processinactivity = 0
+		self.progressinterval = 10
+		self.cutworkers = 1
+		self.pipeline = bool(options.pipeline) if options else False
+		self.prefetchworkers = 4
+		self.prefetchcutlists = 3
+		self.httptimeout = 30
+		self.httpretries = 3
 		
 		self.cutnameformat = "{base}-cut{rating}.{ext}"
 		self.uncutnameformat = "{full}"
@@ -1306,16 +2711,27 @@ class CutOptions:
 			print "Parse Konfigurationsdatei: %s" % configfile
 			self.ParseConfig(configfile)
 		
+		# command line overrides config
+		if options and options.jobs > 0:
+			self.cutworkers = options.jobs
+		
+		# shared by all requests to cutlist.at and onlinetvrecorder.com
+		self.httppool = HTTPConnectionPool(self.httptimeout, self.httpretries, headers={'User-Agent': prog_id})
+		
 		# enforce existence
 		for d in [self.uncutdir,self.cachedir]:
 			if not os.path.exists(d):
 				Debug(4, "init: create directory: %s" % d)
 				os.makedirs(d)
+		
+		# indexes and media information of the recordings, shared by all cuts
+		self.aviindexcache = AviIndexCache(self.cachedir)
+		self.mediaprobe = MediaProbe(self)
 				
 		# find avidemux
 		for avidemux in avidemux_cmds:
 			try:
-				out = Run(avidemux, ["--quit"])[0]
+				out = Run(avidemux, ["--quit"], timeout = 60)[0]
 				self.cmd_AviDemux = avidemux
 				if "Avidemux v2.5" in out:
 					self.cmd_AviDemux_version = "2.5"
@@ -1333,11 +2749,12 @@ class CutOptions:
 		print "Benutze als temp-Verzeichnis: %s" % self.tempdir
 		print "Benutze als cut-Verzeichnisformat: %s" % self.cutdirformat
 		print "Benutze als uncut-Verzeichnis: %s" % self.uncutdir
-		print "Benutze als cache-Verzeichnis: %s" % self.cachedir
+		print "Benutze als cache-Verzeichnis: %s (%s)" % (self.cachedir, self.cachebackend)
 		print "Benutze als cutnameformat: %s" % self.cutnameformat
 		print "Benutze als uncutnameformat: %s" % self.uncutnameformat
 		print "Benutze als AviDemux: %s (v:%s)" % (self.cmd_AviDemux, self.cmd_AviDemux_version)
 		print "Benutze als VirtualDub: %s" % self.cmd_VirtualDub
+		print "Benutze gleichzeitige Schneidevorgänge: %d" % self.cutworkers
 
 		self.cutlistprovider = {}
 		self.defaultproviderlist = []
@@ -1351,6 +2768,10 @@ class CutOptions:
 
 		self.DefaultProjectClass = AviDemuxProjectClass
 		self.RegisteredProjectClasses = {}
+		# tried first, used if their Accepts(cutfile, cutlist, cutoptions) agrees
+		self.PreferredProjectClasses = []
+		if self.smartcopy:
+			self.PreferredProjectClasses.append(AviSmartCopyProjectClass)
 		if self.cmd_VirtualDub:
 			self.RegisteredProjectClasses[".mpg.HQ.avi"] = VDProjectClass
 			self.RegisteredProjectClasses[".mpg.HD.avi"] = VDProjectClass
@@ -1379,6 +2800,18 @@ class CutOptions:
 						self.cmd_Ac3fix = os.path.expanduser(opt)
 					elif cmd == "cachedir":
 						self.cachedir= os.path.expanduser(opt)
+					elif cmd == "cachegcinterval":
+						self.cachegcinterval = datetime.timedelta(hours=float(opt)) if float(opt) > 0 else None
+					elif cmd == "memorycacheentries":
+						self.memorycacheentries = max(0, int(opt))
+					elif cmd == "memorycachemb":
+						self.memorycachebytes = int(max(0, float(opt)) * 2**20)
+					elif cmd == "cachecompression":
+						self.cachecompression = not (opt.lower()=='false' or opt=='0')
+					elif cmd == "cachebackend":
+						if opt.lower() not in ('files', 'sqlite'):
+							raise ValueError("unknown cache backend '%s'" % opt)
+						self.cachebackend = opt.lower()
 
 					elif cmd == "cutname":
 						self.cutnameformat = opt
@@ -1414,6 +2847,34 @@ class CutOptions:
 						self.delavi = not (opt.lower()=='false' or opt=='0')
 					elif cmd == 'nfo':
 						self.nfo = not (opt.lower()=='false' or opt=='0')
+					elif cmd == 'cutworkers':
+						self.cutworkers = max(1, int(opt))
+					elif cmd == 'prefetchworkers':
+						self.prefetchworkers = max(0, int(opt))
+					elif cmd == 'prefetchcutlists':
+						self.prefetchcutlists = max(0, int(opt))
+					elif cmd == 'httptimeout':
+						self.httptimeout = float(opt)
+					elif cmd == 'httpretries':
+						self.httpretries = max(0, int(opt))
+					elif cmd == 'pipeline':
+						self.pipeline = self.pipeline or not (opt.lower()=='false' or opt=='0')
+					elif cmd == 'smartcopy':
+						self.smartcopy = not (opt.lower()=='false' or opt=='0')
+					elif cmd == 'renderworkers':
+						self.renderworkers = max(1, int(opt))
+					elif cmd == 'keyframeinfo':
+						self.keyframeinfo = not (opt.lower()=='false' or opt=='0')
+					elif cmd == 'keyframepenalty':
+						self.keyframepenalty = max(0., float(opt))
+					elif cmd == 'validatecutlists':
+						self.validatecutlists = not (opt.lower()=='false' or opt=='0')
+					elif cmd == 'processtimeout':
+						self.processtimeout = max(0, int(opt))
+					elif cmd == 'processinactivity':
+						self.processinactivity = max(0, int(opt))
+					elif cmd == 'progressinterval':
+						self.progressinterval = max(0, int(opt))
 
 
 				except StandardError, e:
@@ -1422,6 +2883,36 @@ class CutOptions:
 		except:
 			pass
 	
+	def PrintCacheStatistics(self):
+		for prov in self.cutlistprovider.values() + [self.mediaprobe]:
+			for cache in getattr(prov, 'caches', []):
+				Debug(1, "Cache '%s': %s" % (cache.name, cache.memoryCache.statistics()))
+	
+	def MaintainCaches(self, providers=None, force=False):
+		""" removes expired cache entries, at most once per cachegcinterval unless forced """
+		if providers is None:
+			providers = self.cutlistprovider.values()
+		for prov in list(providers) + [self.mediaprobe]:
+			for cache in getattr(prov, 'caches', []):
+				try:
+					if cache.maintain(None if force else self.cachegcinterval):
+						Debug(1, "CutOptions::MaintainCaches: maintained cache '%s'" % cache.name)
+				except StandardError, e:
+					print "Cache '%s' konnte nicht aufgeräumt werden: %s" % (cache.name, e)
+		try:
+			if self.aviindexcache.maintain(None if force else self.cachegcinterval):
+				Debug(1, "CutOptions::MaintainCaches: maintained cache '%s'" % self.aviindexcache.name)
+		except StandardError, e:
+			print "Cache '%s' konnte nicht aufgeräumt werden: %s" % (self.aviindexcache.name, e)
+	
+	def MigrateCaches(self, providers):
+		for prov in list(providers) + [self.mediaprobe]:
+			for cache in prov.caches:
+				try:
+					print "Cache '%s': %d Einträge neu geschrieben" % (cache.name, cache.migrate())
+				except StandardError, e:
+					print "Cache '%s' konnte nicht neu geschrieben werden: %s" % (cache.name, e)
+	
 	def FormatString(self, name, data):
 		if name == "cutname" or name == "uncutname" or name == "cutdir":
 			cutlist, filename = data
@@ -1541,9 +3032,18 @@ class CutFile:
 						for line in cutlist.strip().split('\n'):
 							print ">", line
 						print
+					self.cutlist.PrintWarnings()
 					self.cutlist = None
 				else:
 					print "Keine Cutlist angegeben!"
+			elif self.cutlist and not self.ValidateCutList():
+				self.cutlist = None
+		
+		try:
+			self.cutlist.GetCutListDict()
+		except StandardError:
+			pass # reported when the file is cut
+		self.cutlist.PrintWarnings()
 		
 		# set names
 		self.cutname = self.cutoptions.FormatString("cutname", (self.cutlist, self.filename))
@@ -1574,6 +3074,13 @@ class CutFile:
 
 
 	def Cut(self):
+		self.PrepareCut()
+		self.RunCut()
+		print "Fertig, benötigte Zeit: %ds (%s)" % (int(self.cuttime+0.5), self.progress.Text())
+		return self.FinishCut()
+
+	def PrepareCut(self):
+		""" creates the project, may ask the user, hence has to run in the main thread """
 		self.cutpath = {'avi': os.path.join(self.cutdir, self.cutname) }
 		self.tmppath = {'avi': os.path.join(self.cutdir, self.tmpname) }
 		self.uncutpath = {'avi': os.path.join(self.cutoptions.uncutdir, self.uncutname) }
@@ -1582,22 +3089,47 @@ class CutFile:
 		print "Ausgabename: %s" % self.cutname
 		
 		
-		for extension, registeredclass in self.cutoptions.RegisteredProjectClasses.items():
-			if extension in self.filename:
-				projectclass = registeredclass
+		for preferredclass in self.cutoptions.PreferredProjectClasses:
+			if preferredclass.Accepts(self, self.cutlist, self.cutoptions):
+				projectclass = preferredclass
 				break
 		else:
-			projectclass = self.cutoptions.DefaultProjectClass
-		
-		project = projectclass(self, self.cutlist, self.cutoptions)
+			for extension, registeredclass in self.cutoptions.RegisteredProjectClasses.items():
+				if extension in self.filename:
+					projectclass = registeredclass
+					break
+			else:
+				projectclass = self.cutoptions.DefaultProjectClass
 		
-		print "Schneide mit %s" % project.Name()
+		self.runner = ProcessRunner()
+		self.project = projectclass(self, self.cutlist, self.cutoptions)
+		self.progress = CutProgress(self)
+		self.cutoutput = None
+		self.cuttime = 0
 		
+		print "Schneide mit %s" % self.project.Name()
+
+	def RunCut(self):
+		""" runs the external cutter, safe to call from a worker thread """
 		start = time.time()
-		project.Run() # run
-		end = time.time()
-		print "Fertig, benötigte Zeit: %ds" % int(end-start+0.5)
-			
+		self.progress.Start()
+		try:
+			self.cutoutput = self.project.Run() # run
+		finally:
+			self.cuttime = time.time() - start
+			self.progress.Finish()
+
+	def DiscardCut(self):
+		for entry in self.tmppath:
+			if os.path.isfile(self.tmppath[entry]):
+				Debug(2, "CutFile::DiscardCut: remove %s" % self.tmppath[entry])
+				try:	os.remove(self.tmppath[entry])
+				except: pass # doesn't matter
+
+	def IsSameCut(self, other):
+		return self.cutlist["id"] == other.cutlist["id"] and self.cutname == other.cutname
+
+	def FinishCut(self):
 		if os.path.isfile(self.tmppath['avi']):
 			for entry in self.path:
 				shutil.move(self.path[entry], self.uncutpath[entry])
@@ -1618,7 +3150,11 @@ class CutFile:
 		mkvcmd = ['mkvmerge', '-o', self.cutpath['mkv'], '--compression', '-1:none', self.cutpath['avi']]
 		if 'ac3' in self.cutpath:
 			mkvcmd += [self.cutpath['ac3']]
-		subprocess.Popen(mkvcmd).wait()
+		def progress(line):
+			sys.stdout.write("\r" + line)
+			sys.stdout.flush()
+		Run(mkvcmd[0], mkvcmd[1:], on_stdout = progress, collect = False)
+		print
 		end = time.time()
 		print "Konvertieren abgeschlossen, benötigte Zeit: %ds" % int(end-start+.5)
 
@@ -1710,6 +3246,26 @@ class CutFile:
 				return False
 		return True
 					
+	def ValidateCutList(self):
+		""" checks the chosen cutlist against the recording, asks the user if it does not fit """
+		if not self.cutoptions.validatecutlists:
+			return True
+		if isinstance(self.cutlist.cutlistprov, CutListOwnProvider):
+			Debug(2, "CutFile::ValidateCutList: own cutlists are made from this recording")
+			return True
+		try:
+			problems = self.cutlist.Validate(self.path['avi'], self.GetMediaInfo())
+		except (EnvironmentError, ValueError), e:
+			print "Cutlist konnte nicht geprüft werden: %s" % e
+			return True
+		self.cutlist.PrintWarnings()
+		if not problems:
+			return True
+		print "%s Die Cutlist passt nicht zur Datei: %s %s" % (C_RED, ", ".join(problems), C_CLEAR)
+		s = raw_input("Soll die Cutlist trotzdem verwendet werden? [j/N] ").strip()
+		print
+		return s.lower() == 'j'
+	
 	def GetQuality(self):
 		if ".mpg.HQ" in self.filename:
 			return '+'
@@ -1718,43 +3274,506 @@ class CutFile:
 		else:
 			raise ValueError("Could not determine the quality of the file '%s'" % self.filename)
 
+	def GetMediaInfo(self):
+		""" media information of the recording (see MediaProbe), None if it could not be probed """
+		if not hasattr(self, 'mediainfo'):
+			try:
+				self.mediainfo = self.cutoptions.mediaprobe.Get(self.path['avi'])
+			except (EnvironmentError, ValueError), e:
+				print "Datei konnte nicht untersucht werden: %s" % e
+				self.mediainfo = None
+		return self.mediainfo
+	
 	def GetAspect(self):
-		out = Run("mplayer",  ["-vo", "null", "-nosound", "-frames", "1", self.path['avi']])[0]
-		if "Movie-Aspect is 1.33:1" in out or "Film-Aspekt ist 1.33:1" in out:
-			return "4:3"
-		if "Movie-Aspect is 0.56:1" in out or "Film-Aspekt ist 0.56:1" in out:
-			return "16:9"
-		if "Movie-Aspect is 1.78:1" in out or "Film-Aspekt ist 1.78:1" in out:
+		info = self.GetMediaInfo()
+		dar = ParseRatio(info['dar']) if info and info['dar'] else None
+		if dar and (abs(dar - Fraction(16,9)) < Fraction(1,20) or abs(dar - Fraction(9,16)) < Fraction(1,20)):
 			return "16:9"
 		return "4:3"
 	
 	def GetSampleAspect(self):
-		""" Gets the aspect ratio of a movie using mplayer.
-		Returns without error:
-		aspect_ratio, None
-		with error:
-		None, error_message 
-		from https://github.com/monarc99/otr-verwaltung/blob/23afd48461a78bc2f090685c18f0c1a36b59f043/otrverwaltung/actions/decodeorcut.py#L461"""
-		out = Run("mplayer", ["-msglevel", "all=6", "-vo", "null", "-frames", "1", "-nosound", self.path['avi']])[0]
-		
-		infos_match = re.compile(r"VO Config \((\d{1,})x(\d{1,})->(\d{1,})x(\d{1,})")
-
-		for line in out.split('\n'):
-			m = re.search(infos_match,line)
-			if m:
-				sar = Fraction( int(m.group(3)), int(m.group(1)) )
-				if sar.numerator == 427 and sar.denominator == 360:
-					return "32:27"
-				else:
-					return str(sar.numerator) + ":" + str(sar.denominator)
-			else:
-				pass
+		""" Gets the sample aspect ratio ('num:denom') of a movie from the media probe,
+		asks the user if it is unknown """
+		info = self.GetMediaInfo()
+		if info and info['sar']:
+			return str(info['sar'])
 		print "Sample Aspect Ratio konnte nicht bestimmt werden!"
 		r = raw_input("Sample Aspect Ratio eingeben (Format: num:denom, Enter skips): ").strip()
 		if ':' in r:
 			return r
 		raise Exception("Sample Aspect Ratio konnte nicht bestimmt werden.")
 
+###
+# AVI index
+###
+AVIIF_KEYFRAME = 0x10
+avi_chunk_header = struct.Struct("<4sI")
+avi_idx1_entry = struct.Struct("<4sIII")
+avi_indx_header = struct.Struct("<HBBI4s")
+avi_ix_header = struct.Struct("<HBBI4sQI")
+avi_max_size = 2**32 - 2**20 # riff sizes and idx1 offsets are 32bit
+avi_index_version = 1
+avi_index_expire_period = datetime.timedelta(days=30)
+
+class AviStream:
+	"""
+	stream of an avi file: the fields of its stream header and the data
+	offsets, sizes and keyframe flags of all its chunks
+	"""
+	def __init__(self, number, type, scale, rate, samplesize, strhpos):
+		self.number = number
+		self.type = type
+		self.scale = scale
+		self.rate = rate
+		self.samplesize = samplesize
+		self.strhpos = strhpos
+		self.indx = None
+		self.ckid = "%02dxx" % number
+		
+		self.offsets = array('l')
+		self.sizes = array('l')
+		self.keyframes = array('B')
+	
+	def __len__(self):
+		return len(self.offsets)
+	
+	def Append(self, offset, size, keyframe):
+		self.offsets.append(offset)
+		self.sizes.append(size)
+		self.keyframes.append(1 if keyframe else 0)
+	
+	def Positions(self):
+		""" start of every chunk in units of the stream (samples or blocks) """
+		if not self.samplesize:
+			return xrange(len(self.sizes))
+		positions = []
+		position = 0
+		for size in self.sizes:
+			positions.append(position)
+			position += size // self.samplesize
+		return positions
+	
+	def Length(self, chunks):
+		""" length of the given chunks for the dwLength field of the stream header """
+		if not self.samplesize:
+			return len(chunks)
+		return sum(self.sizes[i] for i in chunks) // self.samplesize
+	
+	def GetState(self):
+		return (self.number, self.type, self.scale, self.rate, self.samplesize, self.strhpos, self.ckid,
+					self.offsets.tostring(), self.sizes.tostring(), self.keyframes.tostring())
+	
+	@staticmethod
+	def FromState(state):
+		number, type, scale, rate, samplesize, strhpos, ckid, offsets, sizes, keyframes = state
+		stream = AviStream(number, type, scale, rate, samplesize, strhpos)
+		stream.ckid = ckid
+		stream.offsets.fromstring(offsets)
+		stream.sizes.fromstring(sizes)
+		stream.keyframes.fromstring(keyframes)
+		return stream
+
+class AviIndex:
+	"""
+	reads the headers and the chunk index (idx1 or OpenDML indx) of an avi file,
+	the file is mapped into memory and parsed in place
+	"""
+	def __init__(self, path, state=None):
+		self.path = path
+		self.streams = []
+		self.avihpos = None
+		self.movipos = None
+		self.idx1 = None
+		self.junkpos = [] # header chunks to be dropped in an AVI 1.0 copy
+		self.keyframelist = None
+		
+		if state:
+			self.SetState(state)
+		else:
+			with open(path, "rb") as f:
+				mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+			try:
+				self.ParseRiff(mm)
+				if any(stream.indx for stream in self.streams):
+					for stream in self.streams:
+						self.ReadIndx(mm, stream)
+				elif self.idx1:
+					self.ReadIdx1(mm)
+				else:
+					raise ValueError("AVI-Datei hat keinen Index")
+			finally:
+				mm.close()
+		
+		videos = [stream for stream in self.streams if stream.type == 'vids']
+		if not videos:
+			raise ValueError("AVI-Datei hat keinen Videostrom")
+		self.video = videos[0]
+	
+	def Chunks(self, mm, start, end):
+		""" yields (fourcc, position, size, list type) of the chunks in [start,end) """
+		pos = start
+		while pos + 8 <= end:
+			fourcc, size = avi_chunk_header.unpack_from(mm, pos)
+			listtype = mm[pos+8:pos+12] if fourcc in ('RIFF','LIST') else None
+			yield fourcc, pos, size, listtype
+			pos += 8 + size + (size & 1)
+	
+	def ParseRiff(self, mm):
+		for fourcc, pos, size, listtype in self.Chunks(mm, 0, len(mm)):
+			if fourcc != 'RIFF':
+				break
+			for fourcc, cpos, csize, clisttype in self.Chunks(mm, pos + 12, min(pos + 8 + size, len(mm))):
+				if fourcc == 'LIST' and clisttype == 'hdrl' and listtype == 'AVI ':
+					self.ParseHeader(mm, cpos + 12, cpos + 8 + csize)
+				elif fourcc == 'LIST' and clisttype == 'movi':
+					if self.movipos is None:
+						self.movipos = cpos
+				elif fourcc == 'idx1':
+					self.idx1 = (cpos + 8, csize)
+		if self.avihpos is None or self.movipos is None:
+			raise ValueError("keine gültige AVI-Datei")
+	
+	def ParseHeader(self, mm, start, end):
+		for fourcc, pos, size, listtype in self.Chunks(mm, start, end):
+			if fourcc == 'avih':
+				self.avihpos = pos + 8
+			elif fourcc == 'LIST' and listtype == 'strl':
+				stream = None
+				for sfourcc, spos, ssize, slisttype in self.Chunks(mm, pos + 12, pos + 8 + size):
+					if sfourcc == 'strh':
+						scale, rate = struct.unpack_from("<II", mm, spos + 8 + 20)
+						samplesize = struct.unpack_from("<I", mm, spos + 8 + 44)[0] if ssize >= 48 else 0
+						stream = AviStream(len(self.streams), mm[spos+8:spos+12], scale, rate, samplesize, spos + 8)
+						self.streams.append(stream)
+					elif sfourcc == 'indx' and stream is not None:
+						stream.indx = spos + 8
+						self.junkpos.append(spos)
+			elif fourcc == 'LIST' and listtype == 'odml':
+				self.junkpos.append(pos)
+	
+	def ReadIdx1(self, mm):
+		offset, size = self.idx1
+		end = min(offset + size, len(mm)) - 15
+		unpack = avi_idx1_entry.unpack_from
+		
+		# offsets are relative to the 'movi' fourcc, some muxers use absolute offsets
+		base = self.movipos + 8
+		for pos in xrange(offset, end, 16):
+			ckid, flags, first, size = unpack(mm, pos)
+			if ckid[:2].isdigit():
+				if mm[base+first:base+first+4] != ckid:
+					base = 0
+				break
+		
+		streams = self.streams
+		for pos in xrange(offset, end, 16):
+			ckid, flags, chunkoffset, chunksize = unpack(mm, pos)
+			if ckid[:2].isdigit():
+				number = int(ckid[:2])
+				if number < len(streams):
+					streams[number].ckid = ckid
+					streams[number].Append(base + chunkoffset + 8, chunksize, flags & AVIIF_KEYFRAME)
+	
+	def ReadIndx(self, mm, stream):
+		if not stream.indx:
+			raise ValueError("Strom %d hat keinen OpenDML-Index" % stream.number)
+		longsperentry, subtype, indextype, count, chunkid = avi_indx_header.unpack_from(mm, stream.indx)
+		for i in xrange(count):
+			ixoffset, ixsize, duration = struct.unpack_from("<QII", mm, stream.indx + 24 + 16*i)
+			longsperentry, subtype, indextype, entries, chunkid, base, reserved = avi_ix_header.unpack_from(mm, ixoffset + 8)
+			stream.ckid = chunkid
+			start = ixoffset + 8 + avi_ix_header.size
+			for pos in xrange(start, start + 4*longsperentry*entries, 4*longsperentry):
+				offset, size = struct.unpack_from("<II", mm, pos)
+				stream.Append(base + offset, size & 0x7fffffff, not size & 0x80000000)
+	
+	def GetState(self):
+		return {'version': avi_index_version, 'itemsize': array('l').itemsize,
+				'avihpos': self.avihpos, 'movipos': self.movipos, 'junkpos': self.junkpos,
+				'streams': [stream.GetState() for stream in self.streams]}
+	
+	def SetState(self, state):
+		if state.get('version') != avi_index_version or state.get('itemsize') != array('l').itemsize:
+			raise ValueError("veraltetes Format")
+		self.avihpos = state['avihpos']
+		self.movipos = state['movipos']
+		self.junkpos = list(state['junkpos'])
+		self.streams = [AviStream.FromState(stream) for stream in state['streams']]
+	
+	def Keyframes(self):
+		""" frame numbers of the keyframes of the video stream """
+		if self.keyframelist is None:
+			self.keyframelist = array('l', (i for i, keyframe in enumerate(self.video.keyframes) if keyframe))
+		return self.keyframelist
+	
+	def KeyframeDistance(self, frame):
+		""" signed distance from frame to the nearest keyframe, negative if the keyframe is earlier """
+		keyframes = self.Keyframes()
+		i = bisect.bisect_left(keyframes, frame)
+		candidates = [keyframes[j] - frame for j in (i-1, i) if 0 <= j < len(keyframes)]
+		return min(candidates, key = abs) if candidates else None
+	
+	def ReencodeFrames(self, start, duration):
+		""" number of frames of the cut before its first keyframe, they have to be re-encoded """
+		keyframes = self.Keyframes()
+		i = bisect.bisect_left(keyframes, start)
+		nextkeyframe = keyframes[i] if i < len(keyframes) else start + duration
+		return min(nextkeyframe - start, duration)
+	
+	def Select(self, frames):
+		"""
+		returns the chunks (stream, chunk number) that belong to the frame ranges
+		frames = [(start, duration)], the chunks of each range ordered by their
+		position in the file
+		"""
+		video = self.video
+		# per stream: positions, end of the stream, last selected chunk and how much
+		# longer (in seconds) the selected chunks are than the selected video
+		others = []
+		for stream in self.streams:
+			if stream is not video and len(stream):
+				positions = stream.Positions()
+				others.append([stream, positions, stream.Length(xrange(len(stream))), 0, 0.])
+		
+		selection = []
+		for start, duration in frames:
+			t0 = float(start) * video.scale / video.rate
+			t1 = float(start + duration) * video.scale / video.rate
+			chunks = [(video, i) for i in xrange(start, start + duration)]
+			for other in others:
+				stream, positions, end, previous, drift = other
+				# the audio chunks are whole blocks, start the range later or earlier
+				# by the difference of the ranges before, so it does not add up
+				first = max(previous, bisect.bisect_left(positions, (t0 + drift) * stream.rate / stream.scale))
+				last = max(first, bisect.bisect_left(positions, t1 * stream.rate / stream.scale))
+				if last > first:
+					length = (positions[last] if last < len(positions) else end) - positions[first]
+					drift += float(length) * stream.scale / stream.rate
+				other[3:] = [last, drift - (t1 - t0)]
+				chunks.extend((stream, i) for i in xrange(first, last))
+			chunks.sort(key = lambda chunk: chunk[0].offsets[chunk[1]])
+			selection.extend(chunks)
+		return selection
+
+def AviCopySize(index, frames):
+	""" size of the file WriteAviCopy would write: headers, chunks of all streams and idx1 """
+	size = 12 + (index.movipos - 12) + 12 + 8 # RIFF, header lists, LIST movi, idx1 header
+	for stream, i in index.Select(frames):
+		chunksize = stream.sizes[i]
+		size += 8 + chunksize + (chunksize & 1) + avi_idx1_entry.size
+	return size
+
+def WriteAviCopy(index, frames, target, blocksize = 8 * 2**20):
+	"""
+	copies the chunks of the frame ranges frames = [(start, duration)] of the
+	indexed avi into target as AVI 1.0 with idx1, nothing is re-encoded
+	"""
+	selection = index.Select(frames)
+	counts = dict((stream.number, []) for stream in index.streams)
+	
+	with open(index.path, "rb") as source:
+		# header lists up to movi with patched lengths and without OpenDML chunks
+		source.seek(12)
+		header = bytearray(source.read(index.movipos - 12))
+		for stream, i in selection:
+			counts[stream.number].append(i)
+		struct.pack_into("<I", header, index.avihpos - 12 + 16, len(counts[index.video.number]))
+		flags = struct.unpack_from("<I", header, index.avihpos - 12 + 12)[0]
+		struct.pack_into("<I", header, index.avihpos - 12 + 12, flags | 0x10) # AVIF_HASINDEX
+		for stream in index.streams:
+			struct.pack_into("<I", header, stream.strhpos - 12 + 32, stream.Length(counts[stream.number]))
+		for pos in index.junkpos:
+			header[pos - 12:pos - 8] = 'JUNK'
+		
+		with open(target, "wb") as out:
+			out.write(avi_chunk_header.pack('RIFF', 0) + 'AVI ')
+			out.write(header)
+			movipos = out.tell()
+			out.write(avi_chunk_header.pack('LIST', 0) + 'movi')
+			
+			idx1 = []
+			run = None # [source position, length] of contiguous chunks
+			def copy(run):
+				source.seek(run[0])
+				remaining = run[1]
+				while remaining > 0:
+					data = source.read(min(blocksize, remaining))
+					if not data:
+						raise IOError("AVI-Datei ist unvollständig")
+					out.write(data)
+					remaining -= len(data)
+			outpos = out.tell()
+			for stream, i in selection:
+				offset, size = stream.offsets[i], stream.sizes[i]
+				length = 8 + size + (size & 1)
+				if run and run[0] + run[1] == offset - 8:
+					run[1] += length
+				else:
+					if run:
+						copy(run)
+					run = [offset - 8, length]
+				idx1.append(avi_idx1_entry.pack(stream.ckid, AVIIF_KEYFRAME if stream.keyframes[i] else 0, outpos - movipos - 8, size))
+				outpos += length
+			if run:
+				copy(run)
+			
+			out.write(avi_chunk_header.pack('idx1', 16 * len(idx1)))
+			out.write(''.join(idx1))
+			end = out.tell()
+			out.seek(movipos + 4)
+			out.write(struct.pack("<I", end - 16 * len(idx1) - 8 - movipos - 8))
+			out.seek(4)
+			out.write(struct.pack("<I", end - 8))
+
+class AviIndexCache:
+	"""
+	keeps the indexes of avi files in memory and compressed in the cache directory,
+	the files are keyed by size and modification time so that renamed or moved
+	recordings are still found
+	"""
+	name = "aviindex"
+	
+	def __init__(self, cachedir, memoryentries=4):
+		self.directory = os.path.join(cachedir, self.name) if cachedir else None
+		self.lock = threading.Lock()
+		self.memoryCache = MemoryCache(memoryentries)
+	
+	def getKey(self, path):
+		st = os.stat(path)
+		return "%d-%d" % (st.st_size, int(st.st_mtime))
+	
+	def getFileName(self, key):
+		return os.path.join(self.directory, "%s.idx" % key)
+	
+	def get(self, path):
+		""" returns the AviIndex of path, scans the file only if it is not cached """
+		key = self.getKey(path)
+		with self.lock:
+			index = self.memoryCache.get((path, key))
+		if index is None:
+			index = self.load(path, key)
+			if index is None:
+				Debug(2, "AviIndexCache::get: scan '%s'" % path)
+				index = AviIndex(path)
+				self.store(key, index)
+			with self.lock:
+				self.memoryCache[(path, key)] = index
+		return index
+	
+	def load(self, path, key):
+		if not self.directory:
+			return None
+		fname = self.getFileName(key)
+		try:
+			with open(fname, 'rb') as f:
+				index = AviIndex(path, marshal.loads(zlib.decompress(f.read())))
+			os.utime(fname, None) # used entries do not expire
+			return index
+		except IOError:
+			return None
+		except (ValueError, TypeError, EOFError, KeyError, zlib.error), e:
+			Debug(1, "AviIndexCache::load: ignore broken file '%s': %s" % (fname, e))
+			return None
+	
+	def store(self, key, index):
+		if not self.directory:
+			return
+		try:
+			if not os.path.exists(self.directory):
+				os.makedirs(self.directory)
+			fd, tmpname = tempfile.mkstemp(dir=self.directory, prefix=".%s." % key)
+			with os.fdopen(fd, 'wb') as f:
+				f.write(zlib.compress(marshal.dumps(index.GetState())))
+			os.rename(tmpname, self.getFileName(key))
+		except EnvironmentError, e:
+			Debug(1, "AviIndexCache::store: could not write '%s': %s" % (key, e))
+	
+	def maintain(self, interval=None):
+		"""
+		removes indexes not used for avi_index_expire_period,
+		skipped if the last maintenance was less than interval (timedelta) ago
+		"""
+		if not self.directory or not os.path.isdir(self.directory):
+			return False
+		stamp = os.path.join(self.directory, ".gc")
+		if interval and os.path.exists(stamp):
+			last = datetime.datetime.fromtimestamp(os.path.getmtime(stamp))
+			if last + interval > datetime.datetime.now():
+				return False
+		
+		expired = time.time() - avi_index_expire_period.days * 86400 - avi_index_expire_period.seconds
+		for fname in os.listdir(self.directory):
+			fname = os.path.join(self.directory, fname)
+			try:
+				if fname.endswith(".idx") and os.path.getmtime(fname) < expired:
+					Debug(2, "AviIndexCache::maintain: removed expired file %s" % fname)
+					os.remove(fname)
+			except OSError:
+				pass
+		open(stamp, 'w').close()
+		return True
+
+###
+# AviSmartCopyProjectClass
+###
+class AviSmartCopyProjectClass:
+	"""
+	cuts without external tools by copying the chunks of the avi file,
+	only possible if every cut starts at a keyframe
+	"""
+	def __init__(self, cutfile, cutlist, cutoptions):
+		self.cutfile = cutfile
+		self.cutlist = cutlist
+		self.cutoptions = cutoptions
+		self.index = cutoptions.aviindexcache.get(self.cutfile.path['avi'])
+	
+	@staticmethod
+	def Accepts(cutfile, cutlist, cutoptions):
+		path = cutfile.path['avi']
+		if not path.endswith(".avi"):
+			return False
+		if cutoptions.useac3 and os.path.exists(os.path.splitext(path)[0] + '.ac3'):
+			Debug(1, "AviSmartCopy: ac3 file has to be cut as well")
+			return False
+		try:
+			index = cutoptions.aviindexcache.get(path)
+		except (EnvironmentError, ValueError, struct.error, OverflowError), e:
+			Debug(1, "AviSmartCopy: could not read index of '%s': %s" % (path, e))
+			return False
+		
+		keyframes = index.video.keyframes
+		frames = zip(*cutlist.TimesInFrames())
+		for start, duration in frames:
+			end = start + duration
+			if duration <= 0 or start < 0 or end > len(keyframes):
+				Debug(1, "AviSmartCopy: cut %d+%d outside of the video" % (start, duration))
+				return False
+			if not keyframes[start]:
+				Debug(1, "AviSmartCopy: cut at frame %d does not start at a keyframe" % start)
+				return False
+			# frames of a partial GOP at the end may reference frames after the cut
+			if end < len(keyframes) and not keyframes[end]:
+				Debug(1, "AviSmartCopy: cut at frame %d does not end before a keyframe" % end)
+				return False
+		if AviCopySize(index, frames) > avi_max_size:
+			Debug(1, "AviSmartCopy: cut file would be too large for AVI 1.0")
+			return False
+		return True
+	
+	def Name(self):
+		return "AVI-Direktkopie"
+	
+	def Run(self):
+		Debug(1, "starting avi smart copy")
+		try:
+			WriteAviCopy(self.index, zip(*self.cutlist.TimesInFrames()), self.cutfile.tmppath['avi'])
+		except (IOError, OSError, ValueError, struct.error), e:
+			print "AVI-Direktkopie fehlgeschlagen: %s" % e
+			try:	os.remove(self.cutfile.tmppath['avi'])
+			except OSError: pass
+			return "", str(e)
+		return "", ""
+
 ###
 # AviDemuxProjectClass
 ###
@@ -1828,7 +3847,94 @@ class AviDemuxProjectClass:
 	
 	def Run(self):
 		Debug(1, "starting avidemux")
-		return Run(self.cutoptions.cmd_AviDemux, ["--force-smart", "--run", self.filename, "--quit"])
+		return Run(self.cutoptions.cmd_AviDemux, ["--force-smart", "--run", self.filename, "--quit"],
+					runner = self.cutfile.runner, timeout = self.cutoptions.processtimeout,
+					inactivity = self.cutoptions.processinactivity)
+
+###
+# AC3
+###
+# frame sizes in 16bit words by sample rate code (48, 44.1, 32 kHz) and frame size code
+ac3_frame_sizes = (
+	(64,64,80,80,96,96,112,112,128,128,160,160,192,192,224,224,256,256,320,320,
+		384,384,448,448,512,512,640,640,768,768,896,896,1024,1024,1152,1152,1280,1280),
+	(69,70,87,88,104,105,121,122,139,140,174,175,208,209,243,244,278,279,348,349,
+		417,418,487,488,557,558,696,697,835,836,975,976,1114,1115,1253,1254,1393,1394),
+	(96,96,120,120,144,144,168,168,192,192,240,240,288,288,336,336,384,384,480,480,
+		576,576,672,672,768,768,960,960,1152,1152,1344,1344,1536,1536,1728,1728,1920,1920),
+	)
+ac3_sample_rates = (48000, 44100, 32000)
+ac3_frame_samples = 1536
+
+def IterAC3Frames(f, blocksize = 2**20):
+	""" yields (frame, sample rate) of the AC3 syncframes in f, skips garbage between frames """
+	buf = ''
+	pos = 0
+	eof = False
+	while True:
+		# keep at least one maximal frame in the buffer
+		if len(buf) - pos < 2 * 1920 * 2 and not eof:
+			data = f.read(blocksize)
+			eof = not data
+			buf = buf[pos:] + data
+			pos = 0
+		if len(buf) - pos < 6:
+			return
+		
+		if buf[pos:pos+2] != '\x0b\x77':
+			i = buf.find('\x0b\x77', pos + 1)
+			pos = i if i >= 0 else len(buf) - 1
+			continue
+		fscod, frmsizecod = ord(buf[pos+4]) >> 6, ord(buf[pos+4]) & 0x3f
+		bsid = ord(buf[pos+5]) >> 3
+		if fscod == 3 or frmsizecod > 37 or bsid > 10:
+			pos += 1 # no (plain) AC3 frame, resync
+			continue
+		size = 2 * ac3_frame_sizes[fscod][frmsizecod]
+		if len(buf) - pos < size:
+			return # truncated last frame
+		yield buf[pos:pos+size], ac3_sample_rates[fscod]
+		pos += size
+
+def CutAC3(source, target, cuts):
+	"""
+	copies the AC3 frames of the cuts [(start, duration)] in seconds from source
+	to target in a single pass, returns the number of frames written
+	"""
+	cuts = list(cuts)
+	# back-to-back cuts may overlap by a rounding error of the float seconds
+	if any(cuts[i][0] < cuts[i-1][0] + cuts[i-1][1] - 1e-6 for i in range(1, len(cuts))):
+		raise ValueError("Schnitte überlappen oder sind nicht aufsteigend")
+	
+	written = 0
+	with open(source, 'rb') as f:
+		with open(target, 'wb') as out:
+			ranges = None
+			for n, (frame, rate) in enumerate(IterAC3Frames(f)):
+				if ranges is None:
+					# frame n covers [n, n+1) * 32ms at 48kHz, each cut starts with the frame
+					# nearest to its start; the frame count follows the total output time so far,
+					# hence the rounding to whole frames does not add up over the cuts
+					duration = float(ac3_frame_samples) / rate
+					ranges = []
+					total = 0.
+					count = 0
+					for start, length in cuts:
+						total += length
+						first = max(int(round(start / duration)), ranges[-1][1] if ranges else 0)
+						frames = max(0, int(round(total / duration)) - count)
+						ranges.append((first, first + frames))
+						count += frames
+				while ranges and n >= ranges[0][1]:
+					ranges.pop(0)
+				if not ranges:
+					break
+				if n >= ranges[0][0]:
+					out.write(frame)
+					written += 1
+	if not written:
+		raise ValueError("keine AC3-Frames gefunden")
+	return written
 
 ###
 # VDProjectClass
@@ -1842,32 +3948,82 @@ class VDProjectClass:
 		self.cutlist = cutlist
 		self.cutoptions = cutoptions
 
+		self.aspect = self.cutfile.GetAspect()
+		self.sample_aspect = None
+		
+		ranges = zip(*self.cutlist.TimesInFrames())
+		if self.cutoptions.renderworkers > 1:
+			ranges = self.SplitRanges(ranges, self.cutoptions.renderworkers)
+		
+		# segment-parallel: one project per segment, the results are appended afterwards
+		self.segments = []
+		if len(ranges) > 1 and self.cutoptions.renderworkers > 1:
+			prefix = "%d_segment" % random.getrandbits(32)
+			for i, r in enumerate(ranges):
+				target = os.path.join(self.cutoptions.tempdir, "%s%d.avi" % (prefix, i))
+				self.segments.append( (self.CreateProject([r], target), target) )
+			self.projectname = "%s_append.syl" % prefix
+			self.filename = os.path.join(self.cutoptions.tempdir, self.projectname)
+			self.Write('VirtualDub.Open("%s",0,0);\n' % self.segments[0][1], "w")
+			for projectname, target in self.segments[1:]:
+				self.Append('VirtualDub.Append("%s");' % target)
+			self.Append('VirtualDub.audio.SetMode(0);')
+			self.Append('VirtualDub.video.SetMode(0);')
+			self.End(self.cutfile.tmppath['avi'])
+		else:
+			self.CreateProject(ranges, self.cutfile.tmppath['avi'])
+		self.prepareAC3()
+	
+	def CreateProject(self, ranges, target):
+		""" writes a project which renders the frame ranges into target, returns its name """
 		self.projectname = "%d_project.syl" % random.getrandbits(32)
 		self.filename = os.path.join(self.cutoptions.tempdir, self.projectname)
 			
 		self.Start(self.cutfile.path['avi'])
 			
-		self.SetAspectRatio(self.cutfile.GetAspect(),self.cutfile.GetQuality(),self.cutfile)
+		self.SetAspectRatio(self.aspect,self.cutfile.GetQuality(),self.cutfile)
 			
 		self.Append("VirtualDub.subset.Clear();")
-		StartInFrames, DurationInFrames = self.cutlist.TimesInFrames()
-		for start, duration in zip(StartInFrames, DurationInFrames):
+		for start, duration in ranges:
 			self.Append("VirtualDub.subset.AddRange(%d,%d);" % (start, duration))
 
-		self.End(self.cutfile.tmppath['avi'])
-		self.prepareAC3()
+		self.End(target)
+		return self.projectname
+	
+	def SplitRanges(self, ranges, parts):
+		""" splits long ranges at keyframes so that there are about parts ranges of similar length """
+		try:
+			keyframes = self.cutoptions.aviindexcache.get(self.cutfile.path['avi']).Keyframes()
+		except (EnvironmentError, ValueError, struct.error, OverflowError), e:
+			Debug(1, "VDProjectClass::SplitRanges: no keyframes, segments are not split: %s" % e)
+			return ranges
+		target = max(1, sum(duration for start, duration in ranges) // parts)
+		
+		result = []
+		for start, duration in ranges:
+			end = start + duration
+			while end - start > target:
+				i = bisect.bisect_left(keyframes, start + target)
+				if i >= len(keyframes) or end - keyframes[i] < target // 2:
+					break # no keyframe or only a short remainder
+				result.append( (start, keyframes[i] - start) )
+				start = keyframes[i]
+			result.append( (start, end - start) )
+		return result
 
 	def prepareAC3(self):
-		self.ffmpegcmd = None
-		if self.cutoptions.useac3:
-			ac3 = self.testAC3()
-			if ac3:
-				Starts, Durations = self.cutlist.TimesInSeconds()
-				if len(Starts)>1:
-					print "More than 1 cut for ac3! Not yet implementet!"
-					return
-				self.ffmpegcmd = ['ffmpeg', '-y', '-i', self.cutfile.path['ac3'], '-ss', '%f' % Starts[0],
-					'-t', '%f' % Durations[0], '-acodec', 'copy', self.cutfile.tmppath['ac3']]
+		self.cutac3 = bool(self.cutoptions.useac3 and self.testAC3())
+	
+	def cutAC3(self):
+		try:
+			frames = CutAC3(self.cutfile.path['ac3'], self.cutfile.tmppath['ac3'], zip(*self.cutlist.TimesInSeconds()))
+			Debug(1, "cut ac3: %d frames" % frames)
+		except (EnvironmentError, ValueError), e:
+			print "AC3-Datei konnte nicht geschnitten werden, fahre ohne AC3 fort: %s" % e
+			try:	os.remove(self.cutfile.tmppath['ac3'])
+			except OSError: pass
+			for paths in (self.cutfile.path, self.cutfile.tmppath, self.cutfile.uncutpath, self.cutfile.cutpath):
+				paths.pop('ac3', None)
 
 	def testAC3(self):
 		Debug(1, "Testing for AC3")
@@ -1878,8 +4034,7 @@ class VDProjectClass:
 				if self.cutoptions.cmd_Ac3fix:
 					Debug(2, "Testing AC3")
 					ac3tmptarget = ac3source + '.fix.ac3'
-					ac3fixcmd = ['wine', self.cutoptions.cmd_Ac3fix, ac3source, ac3tmptarget]
-					out,err=subprocess.Popen(ac3fixcmd, stdout = subprocess.PIPE, stderr=subprocess.PIPE).communicate()
+					out,err = Run('wine', [self.cutoptions.cmd_Ac3fix, ac3source, ac3tmptarget], timeout = self.cutoptions.processtimeout)
 					try: os.remove(ac3tmptarget)
 					except: pass
 					if "Found bad frames" in out:
@@ -1919,7 +4074,9 @@ class VDProjectClass:
 		# http://github.com/elbersb/otr-verwaltung/blob/master/otrverwaltung/codec.py#L14
 		# aktuellere source: http://www.otrforum.com/showthread.php?t=53400&p=324062&viewfull=1#post324062
 		# aktuellere source: https://github.com/monarc99/otr-verwaltung/blob/23afd48461a78bc2f090685c18f0c1a36b59f043/otrverwaltung/actions/decodeorcut.py#L692
-		sample_aspect = self.cutfile.GetSampleAspect()
+		if self.sample_aspect is None:
+			self.sample_aspect = self.cutfile.GetSampleAspect()
+		sample_aspect = self.sample_aspect
 		if quality == '+' :
 			Debug(2, '16:9 HQ')
 			Debug(4,'Blob: VirtualDub.video.SetCompData(2994,"ADLICwAAAADRC1lWMTK6C5CyCAAnDf////8ZDRA...')
@@ -1940,49 +4097,346 @@ class VDProjectClass:
 
 	def Run(self):
 		os.chdir(self.cutoptions.tempdir)
-
-		Debug(1, "starting vd")
-		#vdub_cmd = '/home/matthias/Documents/Programmieren/Python/multicut_evolution/otr-verwaltung/data/media/intern-VirtualDub/vdub.exe'
-		winedir = os.path.dirname(self.cutoptions.cmd_VirtualDub)
-		#sub = subprocess.Popen(args = 'WINEPREFIX=' + winedir + '/wine' + " wineconsole  %s /x /s %s" % (vdub_cmd,self.projectname),
-		#									shell = True, stderr = subprocess.PIPE, stdout = subprocess.PIPE)
-		sub = subprocess.Popen(args = 'WINEPREFIX=' + winedir + '/wine' + " wine  %s /x /s %s" % (self.cutoptions.cmd_VirtualDub,self.projectname),
-											shell = True, stderr = subprocess.PIPE, stdout = subprocess.PIPE)
-		
-		# Make read calls non blocking
-		# from https://stackoverflow.com/questions/8980050/persistent-python-subprocess
-		fcntl.fcntl(sub.stderr.fileno(), fcntl.F_SETFL, os.O_NONBLOCK)
+		
 		errtext = ''
-		while True:
-			if sub.poll() != None:
-				break
+		if self.segments:
+			Debug(1, "starting vd for %d segments with %d workers" % (len(self.segments), self.cutoptions.renderworkers))
+			print "Rendere %d Segmente parallel..." % len(self.segments)
+			pending = [projectname for projectname, target in self.segments]
+			running = []
 			try:
-				output = subprocess.check_output(['wmctrl', '-l'], stderr=subprocess.PIPE)
-				windows = output.split('\n')
-				windows = [w for w in windows if 'virtualdub' in w.lower()]
-				if windows:
-					parts = windows[0].split()
-					parts = [p for p in parts if '%' in p]
+				try:
+					while pending or running:
+						while pending and len(running) < self.cutoptions.renderworkers:
+							running.append(self.StartScript(pending.pop(0), progress=False))
+						for process in self.cutfile.runner.Wait(running, first=True):
+							running.remove(process)
+							errtext += process.Output()[1]
+							process.Check()
+				except ProcessError:
+					for process in running:
+						process.Kill('cancelled')
+					raise
+				missing = [target for projectname, target in self.segments if not os.path.isfile(target)]
+				if missing:
+					print "Segmente konnten nicht gerendert werden: %s" % ", ".join(missing)
+				else:
+					errtext += self.RunScript(self.projectname)
+			finally:
+				# the segments and their projects are not needed any more, even if cancelled
+				for projectname, target in self.segments:
+					for path in (target, os.path.join(self.cutoptions.tempdir, projectname)):
+						try:	os.remove(path)
+						except OSError: pass
+		else:
+			errtext += self.RunScript(self.projectname)
+		
+		if self.cutac3:
+			self.cutAC3()
+		return "", errtext
+	
+	def ProgressPaths(self):
+		""" the files written by each pass (see CutProgress) """
+		return [[target for projectname, target in self.segments], self.cutfile.tmppath.values()]
+	
+	def StartScript(self, projectname, progress=True):
+		""" starts VirtualDub with the project in the temp directory, returns the Process """
+		Debug(1, "starting vd")
+		winedir = os.path.dirname(self.cutoptions.cmd_VirtualDub)
+		started = []
+		
+		def stderr(line):
+			Debug(4, line)
+			# VirtualDub does not quit under wine
+			if 'fixme:avifile:AVIFileExit' in line:
+				started[0].Kill('finished')
+		
+		def window(line):
+			if 'virtualdub' in line.lower():
+				parts = [p for p in line.split() if '%' in p]
+				if parts:
 					print '\rProgress', parts[0],
 					sys.stdout.flush()
-			except Exception as e:
-				#print e
-				pass
+		
+		wmctrl = {'process': None, 'ticks': 0, 'missing': False}
+		def showprogress():
+			# wmctrl runs as another child of the runner every few ticks, the select loop never waits for it
+			wmctrl['ticks'] += 1
+			if wmctrl['missing'] or wmctrl['ticks'] % 4 or (wmctrl['process'] and wmctrl['process'].returncode is None):
+				return
 			try:
-				adderrtxt = sub.stderr.read()
-			except IOError:
-				continue
-			if adderrtxt == '\n':
-				Debug(4, errtext.rpartition('\n')[-1])
-			errtext += adderrtxt
-			if 'fixme:avifile:AVIFileExit' in errtext:
-				sub.send_signal(9) # python >=2.6(?)
-				break
-			time.sleep(0.3)
+				wmctrl['process'] = self.cutfile.runner.Start(['wmctrl', '-l'], on_stdout = window, collect = False, timeout = 5)
+			except OSError:
+				wmctrl['missing'] = True
+		
+		# with several VirtualDub windows the progress would be ambiguous
+		started.append(self.cutfile.runner.Start(["wine", self.cutoptions.cmd_VirtualDub, "/x", "/s", projectname],
+								env = dict(os.environ, WINEPREFIX = winedir + '/wine'), on_stderr = stderr,
+								on_tick = showprogress if progress else None,
+								timeout = self.cutoptions.processtimeout, inactivity = self.cutoptions.processinactivity))
+		return started[0]
+	
+	def RunScript(self, projectname):
+		""" runs VirtualDub with the project in the temp directory and returns its error output """
+		process = self.StartScript(projectname)
+		self.cutfile.runner.Wait([process])
 		print
-		if self.ffmpegcmd:
-			Debug(1, "starting ffmpeg with %r" % self.ffmpegcmd)
-			subprocess.Popen(self.ffmpegcmd, stdout = subprocess.PIPE, stderr = subprocess.PIPE).wait()
+		process.Check()
+		return process.Output()[1]
+
+###
+# progress
+###
+def FormatETA(seconds):
+	seconds = int(seconds + 0.5)
+	return "%d:%2.2d:%2.2d" % (seconds//3600, (seconds//60)%60, seconds%60)
+
+class CutProgress:
+	"""
+	follows a running cut by the growth of its output files, compared with the size
+	expected from the cut durations; needs neither an X session nor cutter output
+	"""
+	def __init__(self, cutfile):
+		self.cutfile = cutfile
+		self.started = None
+		self.finished = None
+		
+		self.frames = sum(cutfile.cutlist.TimesInFrames()[1])
+		self.expected = self.ExpectedSize(cutfile, cutfile.tmppath, cutfile.GetMediaInfo())
+	
+	@staticmethod
+	def ExpectedSize(cutfile, entries, info):
+		""" size of the cut files, estimated from the share of the cuts in the recording, None if unknown """
+		if not info or not info['frames'] or not info['fps']:
+			return None
+		ratio = min(1., sum(cutfile.cutlist.TimesInSeconds()[1]) / (info['frames'] / info['fps']))
+		return sum(os.path.getsize(cutfile.path[entry]) for entry in entries
+					if entry in cutfile.path and os.path.isfile(cutfile.path[entry])) * ratio
+	
+	def Start(self):
+		self.started = time.time()
+	
+	def Finish(self):
+		self.finished = time.time()
+		self.expected = self.Written() or self.expected # the real size, for the batch
+	
+	def Written(self):
+		""" bytes written by the furthest pass, projects with several passes define ProgressPaths() """
+		project = self.cutfile.project
+		if hasattr(project, 'ProgressPaths'):
+			passes = project.ProgressPaths()
+		else:
+			passes = [self.cutfile.tmppath.values()]
+		written = 0
+		for paths in passes:
+			size = 0
+			for path in paths:
+				try:
+					size += os.path.getsize(path)
+				except OSError:
+					pass
+			written = max(written, size)
+		return written
+	
+	def Status(self):
+		""" (fraction, written bytes, bytes/s, frames/s, eta in seconds), unknown values are None """
+		if not self.started:
+			return None, 0, None, None, None
+		written = self.Written()
+		elapsed = max((self.finished or time.time()) - self.started, 1e-3)
+		fraction = min(1., float(written) / self.expected) if self.expected else None
+		if self.finished:
+			fraction = 1.
+		fps = fraction * self.frames / elapsed if fraction is not None else None
+		eta = elapsed * (1 - fraction) / fraction if fraction else None
+		return fraction, written, written / elapsed, fps, eta
+	
+	def Text(self):
+		fraction, written, rate, fps, eta = self.Status()
+		text = "%.0f MB" % (written / 2.**20)
+		if fraction is not None:
+			text = "%3d%% (%s von %.0f MB)" % (int(fraction * 100), text, self.expected / 2.**20)
+		if rate is not None:
+			text += ", %.1f MB/s" % (rate / 2.**20)
+		if fps is not None:
+			text += ", %d Frames/s" % fps
+		if eta is not None and not self.finished:
+			text += ", noch %s" % FormatETA(eta)
+		return text
+
+class ProgressReporter:
+	"""
+	prints every interval seconds the progress of the running cuts and of the whole batch,
+	has to be created in the main thread and reads only the published state of the cuts
+	"""
+	def __init__(self, cutfiles, interval):
+		self.cutfiles = list(cutfiles)
+		self.interval = interval
+		self.started = time.time()
+		# files which are not prepared yet, only from already probed media information
+		self.expected = {}
+		for cutfile in self.cutfiles:
+			if not getattr(cutfile, 'progress', None):
+				self.expected[cutfile] = CutProgress.ExpectedSize(cutfile, cutfile.path, getattr(cutfile, 'mediainfo', None))
+		self.stopped = threading.Event()
+		self.thread = None
+	
+	def Start(self):
+		if self.interval > 0:
+			self.thread = threading.Thread(target=self._Report, name="ProgressReporter")
+			self.thread.daemon = True
+			self.thread.start()
+		return self
+	
+	def Stop(self):
+		self.stopped.set()
+		if self.thread:
+			self.thread.join()
+	
+	def _Report(self):
+		while not self.stopped.wait(self.interval):
+			# between the cuts the main thread may ask the user
+			if self.Running():
+				print self.Text()
+				sys.stdout.flush()
+	
+	def Running(self):
+		for cutfile in self.cutfiles:
+			progress = getattr(cutfile, 'progress', None)
+			if progress and progress.started and not progress.finished:
+				return True
+		return False
+	
+	def Text(self):
+		lines = []
+		done, total, finished = 0., 0., 0
+		for cutfile in self.cutfiles:
+			progress = getattr(cutfile, 'progress', None)
+			if not progress:
+				total += self.expected.get(cutfile) or 0
+				continue
+			if not progress.expected:
+				continue
+			total += progress.expected
+			if progress.finished:
+				finished += 1
+				done += progress.expected
+			elif progress.started:
+				lines.append("  %s: %s" % (cutfile.filename, progress.Text()))
+				done += min(progress.expected, progress.Written())
+		
+		elapsed = time.time() - self.started
+		text = "Fortschritt: %d von %d Datei(en) fertig" % (finished, len(self.cutfiles))
+		if total:
+			text += ", %d%% (%.0f von %.0f MB)" % (int(done / total * 100), done / 2.**20, total / 2.**20)
+			if done and elapsed > 0:
+				text += ", %.1f MB/s, noch %s" % (done / elapsed / 2.**20, FormatETA((total - done) * elapsed / done))
+		return "\n".join([text] + lines)
+
+###
+# CutScheduler
+###
+class CutScheduler:
+	"""
+	runs the cutting processes of several files in parallel
+	"""
+	def __init__(self, workers):
+		self.workers = max(1, workers)
+		self.condition = threading.Condition()
+		self.queue = []
+		self.active = []
+		self.cancelled = []
+		self.results = []
+		self.pending = 0
+		self.closed = False
+		
+		self.threads = []
+		for i in range(self.workers):
+			thread = threading.Thread(target=self._Worker, name="CutScheduler-%d" % i)
+			thread.daemon = True
+			thread.start()
+			self.threads.append(thread)
+	
+	def Submit(self, cutfile):
+		with self.condition:
+			Debug(2, "CutScheduler::Submit: %s" % cutfile.filename)
+			self.queue.append(cutfile)
+			self.pending += 1
+			self.condition.notify_all()
+	
+	def Cancel(self, cutfile):
+		""" drops a cut, a running cut is killed and its result is discarded """
+		with self.condition:
+			Debug(2, "CutScheduler::Cancel: %s" % cutfile.filename)
+			if cutfile in self.queue:
+				self.queue.remove(cutfile)
+				self.pending -= 1
+			elif cutfile in self.active:
+				self.cancelled.append(cutfile)
+				cutfile.runner.Cancel()
+			else:
+				for result in self.results:
+					if result[0] is cutfile:
+						self.results.remove(result)
+						cutfile.DiscardCut()
+						break
+			self.condition.notify_all()
+	
+	def Close(self):
+		with self.condition:
+			self.closed = True
+			self.condition.notify_all()
+	
+	def Results(self):
+		""" yields (cutfile, error) as soon as a cut has finished, until all submitted cuts are done """
+		self.Close()
+		while True:
+			with self.condition:
+				while not self.results and self.pending:
+					self.condition.wait(0.5) # a timeout keeps KeyboardInterrupt working
+				if not self.results:
+					return
+				result = self.results.pop(0)
+			yield result
+	
+	def _NextCutFile(self):
+		# a file is never cut twice at the same time, e.g. after it was reselected
+		busy = [c.path['avi'] for c in self.active]
+		for cutfile in self.queue:
+			if cutfile.path['avi'] not in busy:
+				return cutfile
+		return None
+	
+	def _Worker(self):
+		while True:
+			with self.condition:
+				while not self._NextCutFile() and not (self.closed and not self.queue):
+					self.condition.wait(0.5)
+				cutfile = self._NextCutFile()
+				if not cutfile:
+					return
+				self.queue.remove(cutfile)
+				self.active.append(cutfile)
+			
+			Debug(1, "CutScheduler: starting %s" % cutfile.filename)
+			error = None
+			try:
+				cutfile.RunCut()
+			except StandardError, e:
+				Debug(1, traceback.format_exc())
+				error = e
+			Debug(1, "CutScheduler: finished %s after %ds" % (cutfile.filename, int(cutfile.cuttime+0.5)))
+			
+			with self.condition:
+				self.active.remove(cutfile)
+				if cutfile in self.cancelled:
+					Debug(1, "CutScheduler: discard cancelled %s" % cutfile.filename)
+					self.cancelled.remove(cutfile)
+					cutfile.DiscardCut()
+				else:
+					self.results.append( (cutfile, error) )
+				self.pending -= 1
+				self.condition.notify_all()
 
 ###
 # main function
@@ -2004,8 +4458,12 @@ def main():
 	parser.add_option("-o","--no-internet","--offline", dest="no_internet", action="store_true", default=False)
 	parser.add_option("-c", "--no-comments", action="store_true", default=False)
 	parser.add_option("-s", "--no-suggestions", action="store_true", default=False)
+	parser.add_option("-j", "--jobs", type="int", default=0)
+	parser.add_option("-p", "--pipeline", action="store_true", default=False)
 
 	parser.add_option("--config",dest="configfile",default="~/.multicut_evolution.conf")
+	parser.add_option("--cache-gc", action="store_true", default=False)
+	parser.add_option("--cache-migrate", action="store_true", default=False)
 
 	parser.add_option("--verbosity",type="int",default=0)
 	parser.add_option("-v",action="count",dest="verbosity")
@@ -2027,7 +4485,21 @@ def main():
 
 
 	o = CutOptions(options.configfile, options)
-
+	
+	if options.cache_gc:
+		print "Räume Cache auf..."
+		o.MaintainCaches([CutListAT(o), CutListOwnProvider(o)], force=True)
+		return
+	if options.cache_migrate:
+		print "Schreibe Cache neu..."
+		o.MigrateCaches([CutListAT(o), CutListOwnProvider(o)])
+		return
+	
+	# expired cache entries are removed in the background; no daemon thread,
+	# the interpreter waits for it at exit instead of killing it while it writes
+	if o.cachegcinterval:
+		maintenance = threading.Thread(target=o.MaintainCaches)
+		maintenance.start()
 
 	###
 	# choose cutlists
@@ -2043,6 +4515,10 @@ def main():
 	avis.sort()
 	avis2Choose = avis
 	cutfiles = {}
+	errors = []
+	
+	# in pipeline mode files are cut in the background while choosing the next cutlists
+	pipeline = CutScheduler(o.cutworkers) if o.pipeline else None
 	
 	print
 	print
@@ -2058,6 +4534,12 @@ def main():
 	print
 	print
 	
+	# fetch the cutlist overviews in the background, getView waits for files not yet fetched
+	if 'internet' in o.cutlistprovider and o.prefetchworkers and avis:
+		prefetch = threading.Thread(target=o.cutlistprovider['internet'].Prefetch, args=(avis,))
+		prefetch.daemon = True
+		prefetch.start()
+	
 	
 	while avis2Choose:
 		# choose
@@ -2070,11 +4552,26 @@ def main():
 			try:
 				c = CutFile(avi, o)
 				if c.ChooseCutList():
+					if pipeline:
+						if avi in cutfiles and cutfiles[avi].IsSameCut(c):
+							print "Cutlist unverändert, der Schneidevorgang bleibt eingereiht."
+							continue
+						if avi in cutfiles:
+							pipeline.Cancel(cutfiles.pop(avi))
+						c.PrepareCut()
+						pipeline.Submit(c)
+						print "Schneidevorgang im Hintergrund eingereiht."
 					cutfiles[avi] = c
 				else:
 					if avi in cutfiles:
+						if pipeline:
+							pipeline.Cancel(cutfiles[avi])
 						del cutfiles[avi]
 			except DeletedException:
+				if avi in cutfiles:
+					if pipeline:
+						pipeline.Cancel(cutfiles[avi])
+					del cutfiles[avi]
 				avis.remove(avi)
 			except StandardError, e:
 				print "Ein Fehler ist aufgetreten, die Datei wird nicht geschnitten: %s" % e
@@ -2083,6 +4580,8 @@ def main():
 		if not avis:
 			print
 			print "Keine Datei zum Schneiden gefunden."
+			if pipeline:
+				for _ in pipeline.Results(): pass # wait for cancelled cuts
 			return
 			
 
@@ -2127,6 +4626,8 @@ def main():
 	if not cutfiles:
 		print
 		print "Keine Datei zum Schneiden angegeben."
+		if pipeline:
+			for _ in pipeline.Results(): pass # wait for cancelled cuts
 		return
 	
 	###
@@ -2141,22 +4642,71 @@ def main():
 
 	checkfiles = []
 	convertfiles = []
-	errors = []
 	
-	for i,c in enumerate(cutfiles):
+	if pipeline:
+		scheduler = pipeline
+	elif o.cutworkers > 1:
+		scheduler = CutScheduler(o.cutworkers)
+		for i,c in enumerate(cutfiles):
+			print
+			print "%d von %d" % (i+1, len(cutfiles))
+			try:
+				c.PrepareCut()
+				scheduler.Submit(c)
+			except StandardError,e:
+				print e
+				print "Stacktrace:"
+				traceback.print_exc()
+				print "Life has to go on..."
+				
+				errors.append( (e,c) )
+	else:
+		scheduler = None
+	
+	# created after the files are prepared (with scheduler), sequential cuts are prepared between two cuts
+	reporter = ProgressReporter(cutfiles, o.progressinterval).Start()
+	
+	if scheduler:
 		print
-		print "%d von %d" % (i+1, len(cutfiles))
-		try:
-			if c.Cut():
-				checkfiles.append(c)
-				convertfiles.append(c)
-		except StandardError,e:
-			print e
-			print "Stacktrace:"
-			traceback.print_exc()
-			print "Life has to go on..."
-			
-			errors.append( (e,c) )
+		print "Schneide mit %d gleichzeitigen Vorgängen..." % o.cutworkers
+		for c, e in scheduler.Results():
+			print
+			print "%s fertig, benötigte Zeit: %ds (%s)" % (c.filename, int(c.cuttime+0.5), c.progress.Text())
+			try:
+				if e:
+					print e
+					print "Life has to go on..."
+					errors.append( (e,c) )
+				elif c.FinishCut():
+					checkfiles.append(c)
+					convertfiles.append(c)
+				else:
+					errors.append( (RuntimeError("Schneiden war nicht erfolgreich"),c) )
+			except StandardError,e:
+				print e
+				print "Stacktrace:"
+				traceback.print_exc()
+				print "Life has to go on..."
+				
+				errors.append( (e,c) )
+	else:
+		for i,c in enumerate(cutfiles):
+			print
+			print "%d von %d" % (i+1, len(cutfiles))
+			try:
+				if c.Cut():
+					checkfiles.append(c)
+					convertfiles.append(c)
+				else:
+					errors.append( (RuntimeError("Schneiden war nicht erfolgreich"),c) )
+			except StandardError,e:
+				print e
+				print "Stacktrace:"
+				traceback.print_exc()
+				print "Life has to go on..."
+				
+				errors.append( (e,c) )
+	reporter.Stop()
 	
 	try:
 		if errors:
@@ -2168,6 +4718,13 @@ def main():
 			for e,c in errors:
 				print "Datei:", c.filename
 				print "Fehler:", e
+				if getattr(c, 'cuttime', None):
+					print "Benötigte Zeit: %ds" % int(c.cuttime+0.5)
+				output = getattr(c, 'cutoutput', None)
+				if isinstance(output, tuple) and output[1].strip():
+					print "Ausgabe des Schneideprogramms (Ende):"
+					for line in output[1].strip().split('\n')[-10:]:
+						print ">", line
 				#try:	print c.cutlist.GetCutList()
 				#except Exception, e: print "Cutliste kann nicht angezeigt werden, wegen: '%s'" % e
 				print
@@ -2289,6 +4846,8 @@ def main():
 				print "Stacktrace:"
 				traceback.print_exc()
 				print "There is still something to do..."
+	
+	o.PrintCacheStatistics()
 
 
 if __name__ == '__main__':